@@ -1,51 +1,111 @@
-from collections import defaultdict
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, send_file, jsonify, abort, Response
 from flask_wtf import FlaskForm
-from sqlalchemy import and_
-from wtforms import FileField, SelectField, SubmitField, StringField, DateField, FloatField, IntegerField, TextAreaField
-from wtforms.validators import DataRequired
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from wtforms import BooleanField, FileField, SelectField, SubmitField, StringField, DateField, IntegerField, TextAreaField
+from wtforms.validators import DataRequired, NumberRange
 from werkzeug.utils import secure_filename
 import os
 import json
+import numpy as np
+import click
+import uuid
+import tempfile
+import hmac
 from datetime import datetime
 
 from config import Config
-from database import db
-from models import Participant, Category, Competition, Score
-from utils.excel_handler import import_participants_from_excel, export_results_to_excel
-from utils.draw_generator import categorize_athletes, generate_draw
-from utils.pdf_reporter import generate_results_pdf
+from database import db, init_db
+from models import Participant, Category, Competition, Score, Job
+from utils.draw_generator import (assign_categories, find_overlaps, preview_category, reassign_category,
+                                  release_category, draw_competition, load_draws, NO_CATEGORY)
+from utils.results import calculate_final_results, is_valid_round
+from utils.scoring import is_valid_score, scoring_rule
+from utils.standings import record_score, get_standings_page, rebuild_standings, check_standings, standings_index
+from utils.jobs import job_queue
+from utils.export_cache import export_cache
+from utils.mat_schedule import plan_competition, save_slots
+from utils.migrations import exclusive_lock, upgrade_schema
+from utils.query_plans import audit_routes
+from utils.live import live_results, ALL_CATEGORIES
+from utils.response_cache import response_cache, ALL_COMPETITIONS
+from utils.data_versions import data_versions
+from utils.metrics import metrics
+from utils.pages import (category_counts, category_scores, participants_page, results_page,
+                         PAGE_SIZE, MAX_PAGE_SIZE)
 
 from loguru import logger
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
+# Импорт и экспорт (pandas, openpyxl, reportlab) загружаются при первом обращении,
+# чтобы запуск процесса и команды CLI не платили за них
 
-# Флаг инициализации
+# Маршруты регистрируются на blueprint, приложение собирает create_app
+bp = Blueprint('main', __name__, cli_group=None)
 
-app_initialized = False
 FORMAT_LOG: str = "{time:YYYY-MM-DD at HH:mm:ss} | {level} | {message}"
 LOG_ROTATION: str = "10 MB"
 log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "log.txt")
-logger.add(log_file_path, format=FORMAT_LOG, level="INFO", rotation=LOG_ROTATION)
+log_sink = None
+INIT_LOCK_FILE = '.init.lock'
+MAX_REPORTED_ERRORS = 20
 
-@app.before_request
-def initialize_on_first_request():
-    """Инициализация при первом запросе"""
-    global app_initialized
-    
-    if not app_initialized:
-        # Создание таблиц в базе данных
+
+def create_app(config_object=Config, resume_jobs=True):
+    """Фабрика приложения: конфигурация, расширения, маршруты и явная инициализация хранилища.
+
+    resume_jobs=False - для команд обслуживания рядом с работающим сервером, чтобы они
+    не запускали задачи из очереди: flask --app "app:create_app(resume_jobs=False)" upgrade-db
+
+    Фабрика безопасна для нескольких процессов сервера (см. wsgi.py): схему обновляет
+    один процесс, задачи других живых процессов не перезапускаются.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    init_logging()
+    init_db(app)
+    scoring_rule.init_app(app)
+    data_versions.init_app(app)
+    job_queue.init_app(app)
+    export_cache.init_app(app)
+    live_results.init_app(app)
+    response_cache.init_app(app)
+    metrics.init_app(app)
+    app.register_blueprint(bp)
+
+    init_storage(app)
+    if resume_jobs:
+        # Задачи, прерванные перезапуском, выполняются заново
         with app.app_context():
-            db.create_all()
-            
-            # Создание папки для загрузок
-            uploads_dir = app.config['UPLOAD_FOLDER']
-            os.makedirs(uploads_dir, exist_ok=True)
-            print(f"✅ Приложение инициализировано: создана папка {uploads_dir}")
-        
-        app_initialized = True
+            job_queue.resume_pending()
+    return app
+
+
+def init_logging():
+    """Файл лога подключается один раз на процесс (loguru - глобальный логгер).
+
+    Записи передаются в файл через очередь (enqueue): запросы не ждут диска, а процессы,
+    порожденные после вызова (воркеры gunicorn, см. gunicorn.conf.py), пишут через
+    обработчик родителя, и ротацию файла выполняет только он.
+    """
+    global log_sink
+    if log_sink is None:
+        log_sink = logger.add(log_file_path, format=FORMAT_LOG, level="INFO", rotation=LOG_ROTATION,
+                              enqueue=True)
+
+
+def init_storage(app):
+    """Создание таблиц, недостающих индексов и папки загрузок - один раз при создании приложения.
+
+    Процессы сервера стартуют одновременно, поэтому схема обновляется под файловой блокировкой.
+    """
+    uploads_dir = app.config['UPLOAD_FOLDER']
+    os.makedirs(uploads_dir, exist_ok=True)
+
+    with exclusive_lock(os.path.join(uploads_dir, INIT_LOCK_FILE)), app.app_context():
+        db.create_all()
+        upgrade_schema()
+    logger.info(f"Приложение инициализировано: папка загрузок {uploads_dir}")
 
 # Формы
 class CompetitionForm(FlaskForm):
@@ -56,8 +116,13 @@ class CompetitionForm(FlaskForm):
     end_date   = DateField('Дата окончания', validators=[DataRequired()])
     submit = SubmitField('Создать')
 
+class ScheduleForm(FlaskForm):
+    mats = IntegerField('Ковров', validators=[DataRequired(), NumberRange(min=1, max=20)])
+    submit = SubmitField('Перепланировать')
+
 class UploadForm(FlaskForm):
     excel_file = FileField('Excel файл', validators=[DataRequired()])
+    deactivate_missing = BooleanField('Файл содержит полный состав: отключить участников, которых в нем нет')
     submit = SubmitField('Загрузить')
 
 class CategoryForm(FlaskForm):
@@ -67,27 +132,66 @@ class CategoryForm(FlaskForm):
     gender = SelectField('Пол', choices=[('mixed', 'Смешанный'), ('male', 'Мужской'), ('female', 'Женский')])
     submit = SubmitField('Создать категорию')
 
+# Значения поля "Пол" формы и в БД (у смешанной категории пол не задан)
+GENDERS = {'male': 'м', 'female': 'ж', 'mixed': None}
+
 
 # Вспомогательные функции
 def allowed_file(filename):
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 # Маршруты
-@app.route('/')
+@bp.route('/')
 def index():
-    competitions = Competition.query.all()
-    athletes_count = Participant.query.count()
-    active_competitions = Competition.query.filter_by(status='active').count()
-    
-    return render_template('index.html', 
-                         competitions=competitions,
-                         athletes_count=athletes_count,
-                         active_competitions=active_competitions)
+    def build():
+        return {
+            'competitions': [competition_data(competition) for competition in Competition.query.all()],
+            'athletes_count': Participant.query.count(),
+            'active_competitions': Competition.query.filter_by(status='active').count()
+        }
+    
+    return render_template('index.html', **response_cache.get_or_set('index', ALL_COMPETITIONS, build))
+
+def competition_data(competition):
+    """Поля соревнования для кэша страниц: словарь не привязан к сессии БД"""
+    return {column.name: getattr(competition, column.name) for column in Competition.__table__.columns}
+
+@bp.route('/cache/stats')
+def cache_stats():
+    """Попадания и промахи кэша страниц"""
+    return jsonify(response_cache.stats())
 
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+def metrics_allowed():
+    """Доступ к /metrics: по METRICS_TOKEN, а без него - только локальный запрос не через прокси
+    (за nginx все запросы приходят с 127.0.0.1, их выдает X-Forwarded-For)"""
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('X-Metrics-Token', ''), token)
+    return request.remote_addr in LOCAL_ADDRESSES and 'X-Forwarded-For' not in request.headers
+
+@bp.route('/metrics', methods=['GET', 'POST'])
+def metrics_view():
+    """Снимок замеров; POST {"enabled": bool, "reset": bool} переключает сбор без перезапуска.
+
+    Переключение и сброс действуют на все процессы сервера (через таблицу settings, в течение
+    METRICS_SYNC_SECONDS), а замеры каждый процесс ведет свои; pid показывает, какой процесс ответил.
+    """
+    if not metrics_allowed():
+        abort(403)
+    if request.method == 'POST':
+        options = request.get_json(silent=True) or {}
+        enabled = bool(options['enabled']) if 'enabled' in options else None
+        metrics.share(enabled=enabled, reset=bool(options.get('reset')))
+        db.session.commit()
+    metrics.sync(force=True)
+    return jsonify(dict(metrics.snapshot(), response_cache=response_cache.stats(), pid=os.getpid()))
 
 
-@app.route('/create_competition', methods=['GET', 'POST'])
+
+@bp.route('/create_competition', methods=['GET', 'POST'])
 def create_competition():
     form = CompetitionForm()
     if form.validate_on_submit():
@@ -100,32 +204,106 @@ def create_competition():
             status='pending'
         )
         db.session.add(competition)
+        response_cache.invalidate()
         db.session.commit()
         
         flash('Соревнование создано')
-        return redirect(url_for('view_competition', id=competition.id))
+        return redirect(url_for('main.view_competition', id=competition.id))
     
     return render_template('create_competition.html', form=form)
 
-@app.route('/competition/<int:id>')
+@bp.route('/competition/<int:id>')
 def view_competition(id):
-    competition = Competition.query.get_or_404(id)
-    # draw = json.loads(competition.draw_data) if competition.draw_data else {}
+    def build():
+        competition = Competition.query.get_or_404(id)
+        # Получение результатов
+        # scores = Score.query.filter_by(competition_id=id).all()
+        # scores = Score.query.all()
+        return {
+            'competition': competition_data(competition),
+            'participants_count': Participant.query.filter_by(competition_id=id).count(),
+            'categories_count': Category.query.filter_by(competition_id=id).count(),
+            'draw': draw_with_names(id)
+        }
     
-    # Получение результатов
-    # scores = Score.query.filter_by(competition_id=id).all()
-    # scores = Score.query.all()
-    participants_count = Participant.query.filter_by(competition_id=id).count()
-    categories_count = Category.query.filter_by(competition_id=id).count()
     return render_template('competition.html', 
-                         competition=competition, 
-                         participants_count=participants_count,
-                         categories_count=categories_count,
-                        #  draw=draw,
-                        #  scores=scores
-                        )
-
-@app.route('/competition/<int:id>/upload/', methods=['GET', 'POST'])
+                         draw_form=FlaskForm(),
+                         **response_cache.get_or_set('competition', id, build))
+
+def draw_with_names(competition_id):
+    """Сохраненная жеребьевка для показа: [({id, name} категории, seed, [(id, спортсмен, клуб)])]"""
+    draws = load_draws(competition_id)
+    if not draws:
+        return []
+    
+    categories = Category.query.filter_by(competition_id=competition_id).order_by(Category.id).all()
+    athletes = {pid: (pid, f'{last_name} {first_name}', club) for pid, last_name, first_name, club in
+                db.session.query(Participant.id, Participant.last_name, Participant.first_name, Participant.club)
+                .filter(Participant.competition_id == competition_id, Participant.is_active.isnot(False))}
+    return [({'id': category.id, 'name': category.name}, draws[category.id]['seed'],
+             [athletes[pid] for pid in draws[category.id]['order'] if pid in athletes])
+            for category in categories if category.id in draws]
+
+@bp.route('/competition/<int:id>/draw', methods=['GET', 'POST'])
+def draw_competition_route(id):
+    """Жеребьевка всех категорий (POST) и сохраненный порядок выступления (GET, JSON)"""
+    Competition.query.get_or_404(id)
+    if request.method == 'GET':
+        return jsonify({category['id']: {'name': category['name'], 'seed': seed,
+                                      'order': [{'id': pid, 'name': name, 'club': club} for pid, name, club in order]}
+                        for category, seed, order in draw_with_names(id)})
+    
+    if not FlaskForm().validate_on_submit():
+        abort(400)
+    seed, draws = draw_competition(id, request.form.get('seed', '').strip())
+    response_cache.invalidate(id)
+    db.session.commit()
+    flash(f'Жеребьевка проведена: категорий {len(draws)}, seed {seed}')
+    return redirect(url_for('main.view_competition', id=id))
+
+@bp.route('/competition/<int:id>/draw/<int:category_id>', methods=['POST'])
+def redraw_category(id, category_id):
+    """Перегенерация порядка одной категории, остальные не меняются"""
+    Category.query.filter_by(id=category_id, competition_id=id).first_or_404()
+    if not FlaskForm().validate_on_submit():
+        abort(400)
+    seed, _ = draw_competition(id, request.form.get('seed', '').strip(), category_id=category_id)
+    response_cache.invalidate(id)
+    db.session.commit()
+    flash(f'Порядок категории обновлен, seed {seed}')
+    return redirect(url_for('main.view_competition', id=id))
+
+@bp.route('/competition/<int:id>/schedule', methods=['GET', 'POST'])
+def mat_schedule(id):
+    """Расписание ковров: прогноз по сохраненному плану (GET) и перепланировка не начатых категорий (POST)"""
+    competition = Competition.query.get_or_404(id)
+    form = ScheduleForm()
+    if form.validate_on_submit():
+        plan, lanes = plan_competition(id, current_app.config, mats=form.mats.data, reassign=True)
+        save_slots(id, lanes)
+        db.session.commit()
+        logger.info(f"Расписание ковров соревнования {id}: ковров {len(plan['mats'])}, "
+                    f"окончание {plan['finish']:%H:%M} UTC")
+        flash(f"Расписание составлено: ковров {len(plan['mats'])}")
+        return redirect(url_for('main.mat_schedule', id=id))
+
+    plan, _ = plan_competition(id, current_app.config)
+    if not form.is_submitted():
+        form.mats.data = len(plan['mats'])
+    return render_template('schedule.html', competition=competition, plan=plan, form=form)
+
+@bp.route('/competition/<int:id>/schedule/data')
+def mat_schedule_data(id):
+    """План ковров в JSON с прогнозом по фактическому темпу.
+
+    ?mats=N&replan=1 - как разложились бы не начатые категории на N ковров (без сохранения).
+    """
+    Competition.query.get_or_404(id)
+    plan, _ = plan_competition(id, current_app.config, mats=request.args.get('mats', type=int),
+                               reassign=request.args.get('replan', 0, type=int) == 1)
+    return jsonify(plan)
+
+@bp.route('/competition/<int:id>/upload/', methods=['GET', 'POST'])
 def upload_participants(id):
     form = UploadForm()
     if form.validate_on_submit():
@@ -139,247 +317,550 @@ def upload_participants(id):
             return redirect(request.url)
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            # Уникальное имя: параллельные загрузки не перезаписывают друг друга
+            filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
             
-            try:
-                participants = import_participants_from_excel(filepath, id)
-                for participant in participants:
-                    db.session.add(participant)
-                db.session.commit()
-                flash(f'Успешно загружено {len(participants)} спортсменов')
-                return redirect(url_for('manage_categories', id =id))
-            except Exception as e:
-                flash(f'Ошибка: {str(e)}')
-    
-    return render_template('upload.html', form=form)
-
-@app.route('/competition/<int:id>/categories/', methods=['GET', 'POST'])
+            job = job_queue.submit('import_participants', file_path=filepath, competition_id=id,
+                                   deactivate_missing=form.deactivate_missing.data)
+            return redirect(url_for('main.upload_participants', id=id, job=job.id))
+    
+    return render_template('upload.html', form=form,
+                           job_id=request.args.get('job', type=int),
+                           done_url=url_for('main.manage_categories', id=id))
+
+@bp.route('/competition/<int:id>/categories/', methods=['GET', 'POST'])
 def manage_categories(id):
     competition = Competition.query.get_or_404(id)
     form = CategoryForm()
     if form.validate_on_submit():
-        logger.error(form.gender.data)
+        gender = GENDERS.get(form.gender.data)
+        overlaps = find_overlaps(id, form.min_age.data, form.max_age.data, gender)
+        if overlaps:
+            flash('Категория пересекается с: ' + ', '.join(c.name for c in overlaps))
+            return redirect(url_for('main.manage_categories', id=id))
+        
         category = Category(
             name=form.name.data,
             competition_id = id,
             min_age=form.min_age.data,
             max_age=form.max_age.data,
-            gender="м" if form.gender.data == "male" else "ж"
+            gender=gender
         )
         db.session.add(category)
-        participants = Participant.query.filter(and_(Participant.age>=category.min_age,
-                                                     Participant.age<=category.max_age,
-                                                     Participant.gender==category.gender)).all()
-        for participant in participants:
-            participant.set_category(category.id)
+        _, assigned = reassign_category(category)
+        rebuild_standings(id, commit=False)
+        response_cache.invalidate(id)
+        db.session.commit()
+        logger.info(f'Категория {category.name} ({form.gender.data}, {category.min_age}-{category.max_age}) в соревновании {id}, спортсменов: {assigned}')
+        flash(f'Категория создана, спортсменов: {assigned}')
+        return redirect(url_for('main.manage_categories', id=id))
+    
+    # Автоматическое распределение: пересчитывается только после изменений;
+    # таблица мест перестраивается в той же транзакции, что и смена категорий
+    if competition.categories_stale is not False:
+        if assign_categories(competition):
+            rebuild_standings(id, commit=False)
+        response_cache.invalidate(id)
         db.session.commit()
-        flash('Категория создана')
-        return redirect(url_for('manage_categories', id=id))
-    
-    categories = Category.query.all()
-    participants = Participant.query.all()
     
-    # Автоматическое распределение
-    categorized = categorize_athletes(participants, categories)
+    # Списки участников подгружаются по категориям через category_participants
+    categories = Category.query.filter_by(competition_id=id).all()
+    counts = category_counts(id)
     
     return render_template('categories.html', 
                          form=form, 
                          competition=competition,
                          categories=categories, 
-                         participants=participants,
-                         categorized=categorized)
+                         counts=counts,
+                         participants_count=sum(counts.values()))
 
-@app.route('/competition/<int:id>/categories_view/')
+@bp.route('/competition/<int:id>/categories/<int:category_id>/edit', methods=['POST'])
+def edit_category(id, category_id):
+    category = Category.query.filter_by(id=category_id, competition_id=id).first_or_404()
+    form = CategoryForm()
+    if not form.validate_on_submit():
+        flash('Проверьте поля категории')
+        return redirect(url_for('main.manage_categories', id=id))
+    
+    gender = GENDERS.get(form.gender.data)
+    overlaps = find_overlaps(id, form.min_age.data, form.max_age.data, gender, exclude_id=category_id)
+    if overlaps:
+        flash('Категория пересекается с: ' + ', '.join(c.name for c in overlaps))
+        return redirect(url_for('main.manage_categories', id=id))
+    
+    category.name = form.name.data
+    category.min_age = form.min_age.data
+    category.max_age = form.max_age.data
+    category.gender = gender
+    released, assigned = reassign_category(category)
+    rebuild_standings(id, commit=False)
+    response_cache.invalidate(id)
+    db.session.commit()
+    flash(f'Категория изменена: снято {released}, распределено {assigned} спортсменов')
+    return redirect(url_for('main.manage_categories', id=id))
+
+@bp.route('/competition/<int:id>/categories/<int:category_id>/delete', methods=['POST'])
+def delete_category(id, category_id):
+    category = Category.query.filter_by(id=category_id, competition_id=id).first_or_404()
+    if not FlaskForm().validate_on_submit():
+        abort(400)
+    
+    released = release_category(category)
+    db.session.delete(category)
+    rebuild_standings(id, commit=False)
+    response_cache.invalidate(id)
+    db.session.commit()
+    flash(f'Категория удалена, без категории осталось {released} спортсменов')
+    return redirect(url_for('main.manage_categories', id=id))
+
+@bp.route('/competition/<int:id>/categories/preview')
+def preview_category_assignment(id):
+    """Пробный расчет: сколько спортсменов попадет в категорию и с кем она пересекается"""
+    min_age = request.args.get('min_age', type=int)
+    max_age = request.args.get('max_age', type=int)
+    gender = GENDERS.get(request.args.get('gender'))
+    exclude_id = request.args.get('category_id', type=int)
+    return jsonify({
+        'count': preview_category(id, min_age, max_age, gender),
+        'overlaps': [c.name for c in find_overlaps(id, min_age, max_age, gender, exclude_id=exclude_id)]
+    })
+
+@bp.route('/competition/<int:id>/categories/<int:category_id>/participants')
+def category_participants(id, category_id):
+    """Участники категории постранично (keyset по id); category_id=0 - без категории"""
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    rows, next_cursor = participants_page(id, category_id or None, request.args.get('after', 0, type=int), limit)
+    return jsonify({'rows': rows, 'next': next_cursor})
+
+@bp.route('/competition/<int:id>/categories_view/')
 def view_competition_categories(id):
-    """Просмотр категорий соревнования с участниками и результатами"""
-    # db = get_db()
-    # cursor = db.cursor()
-    
-    # Получаем соревнование
-    competition = Competition.query.get_or_404(id)
-    
-    # Получаем распределение по категориям
-    participants = db.session.query(Participant, Category).join(Category, Category.id == Participant.category_id
-                                                                      ).filter(and_(Participant.competition_id==id,Participant.category_id!=None)).all()
-    
-    participants_categories={}
-    for participant, category in participants:
-        if participants_categories.get(category.id) ==0:
-            participants_categories["category.id"] = {'participant':participant,
-                                                      ''}
-    # for row in participants:
-    #     athletes_by_category[row['category_name']].append(dict(row))
-    
-    # # Получаем сетку (draw_data) если есть
-    # draw_data = None
-    # if competition['draw_data']:
-    #     try:
-    #         draw_data = json.loads(competition['draw_data'])
-    #     except json.JSONDecodeError:
-    #         draw_data = {}
-    
-    # Получаем оценки для каждого участника    
-    scores_data = Score.query.all()
-    
-    # # Группируем оценки по участникам
-    # athlete_scores = defaultdict(lambda: {1: None, 2: None, 3: None, 'total': 0, 'average': 0})
-    # for score in scores_data:
-    #     athlete_id = score['athlete_id']
-    #     round_num = score['round_number']
-    #     athlete_scores[athlete_id][round_num] = score['average']
-    
-    # # Рассчитываем итоговые баллы (2 лучших раунда из 3)
-    # for athlete_id, scores in athlete_scores.items():
-    #     round_scores = [scores[1], scores[2], scores[3]]
-    #     valid_scores = [s for s in round_scores if s is not None]
-        
-    #     if len(valid_scores) >= 2:
-    #         valid_scores.sort(reverse=True)
-    #         total = sum(valid_scores[:2])
-    #         average = total / 2
-    #     elif valid_scores:
-    #         total = valid_scores[0]
-    #         average = valid_scores[0]
-    #     else:
-    #         total = 0
-    #         average = 0
-        
-    #     scores['total'] = total
-    #     scores['average'] = average
+    """Просмотр категорий соревнования; участники категории подгружаются при открытии панели"""
+    def build():
+        competition = Competition.query.get_or_404(id)
+        counts = category_counts(id)
+        return {
+            'competition': competition_data(competition),
+            'categories': [{'id': category.id, 'name': category.name}
+                           for category in Category.query.filter_by(competition_id=id).order_by(Category.id)
+                           if counts.get(category.id)],
+            'counts': counts,
+            'scores': category_scores(id),
+            'draws': load_draws(id)
+        }
     
     return render_template('competition_categories.html',
-                         competition=competition,
-                         participants=participants
-                        #  athletes_by_category=athletes_by_category,
-                        #  draw_data=draw_data,
-                        #  athlete_scores=athlete_scores
-                         )
+                         draw_form=FlaskForm(),
+                         **response_cache.get_or_set('competition_categories', id, build))
 
-@app.route('/enter_scores', methods=['POST'])
-def enter_scores():
-    data = request.json
-    athlete_id = data['athlete_id']
-    competition_id = data['competition_id']
-    round_number = data['round_number']
-    scores = data['scores']
-    
-    # Поиск существующей записи
+def save_score(participant_id, round_number, scores):
+    """Запись оценок судей за раунд (поиск по уникальному индексу участник + раунд)"""
     score = Score.query.filter_by(
-        athlete_id=athlete_id,
-        competition_id=competition_id,
+        participant_id=participant_id,
         round_number=round_number
     ).first()
     
     if not score:
         score = Score(
-            athlete_id=athlete_id,
-            competition_id=competition_id,
+            participant_id=participant_id,
             round_number=round_number
         )
     
-    # Установка оценок
-    score.judge1 = scores[0]
-    score.judge2 = scores[1]
-    score.judge3 = scores[2]
-    score.judge4 = scores[3]
-    score.judge5 = scores[4]
+    # Установка оценок в порядке судей из правила подсчета
+    for field, value in zip(scoring_rule.judge_fields, scores):
+        setattr(score, field, value)
     score.calculate_scores()
     
     db.session.add(score)
-    db.session.commit()
-    
-    return jsonify({'success': True, 'average': score.average})
+    db.session.flush()
+    return score
+
+@bp.route('/enter_scores', methods=['POST'])
+def enter_scores():
+    data = request.json
+    athlete_id = data['athlete_id']
+    round_number = data['round_number']
+    scores = data['scores']
+    if not is_valid_round(round_number):
+        return jsonify({'success': False, 'error': 'Некорректный номер раунда'}), 400
+    if not isinstance(scores, list) or len(scores) != len(scoring_rule.judge_fields) \
+            or not all(is_valid_score(value) for value in scores):
+        return jsonify({'success': False,
+                        'error': f'Нужно {len(scoring_rule.judge_fields)} оценок числами'}), 400
+
+    participant = Participant.query.get_or_404(athlete_id)
+    if participant.is_active is False:
+        return jsonify({'success': False, 'error': 'Спортсмен отключен'}), 400
+    group = (participant.competition_id, participant.category_id)
+    
+    # Параллельный запрос мог успеть вставить тот же раунд - тогда повторяем как обновление
+    for attempt in range(2):
+        try:
+            score = save_score(athlete_id, round_number, scores)
+            standing = record_score(participant)
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            standings_index.invalidate(group)
+            if attempt:
+                raise
+        except Exception:
+            db.session.rollback()
+            standings_index.invalidate(group)
+            raise
+    
+    return jsonify({'success': True, 'total': score.total,
+                    'average': standing.average, 'place': standing.place})
+
+@bp.route('/enter_scores/batch', methods=['POST'])
+def enter_scores_batch():
+    """Оценки целого потока (многих спортсменов и раундов) одной транзакцией.
+    
+    Ожидает {"scores": [{"athlete_id", "round_number", "scores": [5 оценок]}, ...]},
+    возвращает статус по каждой строке в том же порядке.
+    """
+    items = (request.json or {}).get('scores', [])
+    statuses = [None] * len(items)
+    
+    athlete_ids = {item.get('athlete_id') for item in items
+                   if isinstance(item, dict) and isinstance(item.get('athlete_id'), int)}
+    participants = {p.id: p for p in Participant.query.filter(Participant.id.in_(athlete_ids)).all()}
+    
+    valid = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            statuses[position] = {'status': 'error', 'error': 'Ожидается объект'}
+        elif item.get('athlete_id') not in participants:
+            statuses[position] = {'status': 'error', 'error': 'Спортсмен не найден'}
+        elif participants[item['athlete_id']].is_active is False:
+            statuses[position] = {'status': 'error', 'error': 'Спортсмен отключен'}
+        elif not is_valid_round(item.get('round_number')):
+            statuses[position] = {'status': 'error', 'error': 'Некорректный номер раунда'}
+        elif not isinstance(item.get('scores'), list) or len(item['scores']) != len(scoring_rule.judge_fields):
+            statuses[position] = {'status': 'error', 'error': f'Нужно {len(scoring_rule.judge_fields)} оценок'}
+        elif not all(is_valid_score(value) for value in item['scores']):
+            statuses[position] = {'status': 'error', 'error': 'Оценки должны быть числами'}
+        else:
+            valid.append(position)
+    
+    if valid:
+        totals = scoring_rule.totals([items[position]['scores'] for position in valid])
+        rows = {}
+        for position, total in zip(valid, totals):
+            item = items[position]
+            row = {'participant_id': item['athlete_id'], 'round_number': item['round_number'],
+                   'total': None if np.isnan(total) else float(total)}
+            row.update(zip(scoring_rule.judge_fields, item['scores']))
+            # Повтор того же раунда в пакете - побеждает последняя строка
+            rows[(row['participant_id'], row['round_number'])] = row
+        
+        groups = {(p.competition_id, p.category_id) for p in participants.values()}
+        try:
+            upsert_scores(list(rows.values()))
+            standings = {pid: record_score(participants[pid]) for pid in {pid for pid, _ in rows}}
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for group in groups:
+                standings_index.invalidate(group)
+            raise
+        
+        for position in valid:
+            item = items[position]
+            row = rows[(item['athlete_id'], item['round_number'])]
+            standing = standings[item['athlete_id']]
+            statuses[position] = {'status': 'ok', 'total': row['total'],
+                                  'average': standing.average, 'place': standing.place}
+    
+    return jsonify({'success': all(s['status'] == 'ok' for s in statuses), 'results': statuses})
 
-@app.route('/results/<int:competition_id>')
+def upsert_scores(rows):
+    """INSERT ... ON CONFLICT DO UPDATE по уникальному индексу (участник, раунд), одним executemany.
+    
+    scored_at - время первой оценки раунда, как в Score.calculate_scores.
+    """
+    scored_at = datetime.utcnow()
+    rows = [dict(row, scored_at=scored_at if row['total'] is not None else None) for row in rows]
+    table = Score.__table__
+    statement = sqlite_insert(table)
+    set_ = {field: statement.excluded[field] for field in scoring_rule.judge_fields + ['total']}
+    set_['scored_at'] = func.coalesce(table.c.scored_at, statement.excluded.scored_at)
+    statement = statement.on_conflict_do_update(index_elements=['participant_id', 'round_number'], set_=set_)
+    db.session.execute(statement, rows)
+
+@bp.route('/standings/<int:competition_id>')
+def show_standings(competition_id):
+    """Страница турнирной таблицы из материализованных мест.
+    
+    ?category_id=N - одна категория (0 - без категории), без него - все категории
+    соревнования, у каждой своя страница offset/limit.
+    """
+    category_id = request.args.get('category_id', type=int)
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    
+    if category_id is not None:
+        rows = get_standings_page(competition_id, category_id or None, offset, limit)
+        return jsonify({'rows': rows,
+                        'total': standings_index.size((competition_id, category_id or None))})
+    
+    scores = category_scores(competition_id)
+    sections = [(category.id, category.name)
+                for category in Category.query.filter_by(competition_id=competition_id).order_by(Category.id)
+                if category.id in scores]
+    if None in scores:
+        sections.append((0, NO_CATEGORY))
+    return jsonify({'categories': [{
+        'category_id': section_id,
+        'name': name,
+        'rows': get_standings_page(competition_id, section_id or None, offset, limit),
+        'total': scores[section_id or None]['count']
+    } for section_id, name in sections]})
+
+@bp.cli.command('rebuild-standings')
+@click.argument('competition_id', type=int)
+@click.option('--check', is_flag=True, help='Только сверить таблицу с calculate_final_results')
+def rebuild_standings_command(competition_id, check):
+    """Перестроение турнирной таблицы из таблицы scores"""
+    if not check:
+        results = rebuild_standings(competition_id)
+        click.echo(f'Перестроено строк: {len(results)}')
+    mismatches = check_standings(competition_id)
+    for participant_id, (expected, actual) in sorted(mismatches.items()):
+        click.echo(f'{participant_id}: ожидалось {expected}, в таблице {actual}')
+    click.echo('Расхождений нет' if not mismatches else f'Расхождений: {len(mismatches)}')
+
+@bp.route('/results/<int:competition_id>')
 def show_results(competition_id):
+    return render_template('results.html', live_retry_seconds=current_app.config['LIVE_RETRY_SECONDS'],
+                           **response_cache.get_or_set('results', competition_id,
+                                                       lambda: results_summary(competition_id)))
+
+def results_summary(competition_id):
+    """Разделы и статистика страницы результатов; таблицы категорий подгружаются через category_results"""
     competition = Competition.query.get_or_404(competition_id)
+    scores = category_scores(competition_id)
+    sections = [(category.id, category.name, scores[category.id]['count'])
+                for category in Category.query.filter_by(competition_id=competition_id).order_by(Category.id)
+                if category.id in scores]
+    if None in scores:
+        sections.append((0, NO_CATEGORY, scores[None]['count']))
+    
+    scored = sum(group['count'] for group in scores.values())
+    stats = {
+        'participants': scored,
+        'average': sum(group['average'] * group['count'] for group in scores.values()) / scored if scored else 0,
+        'max': max((group['max'] for group in scores.values()), default=0),
+        'min': min((group['min'] for group in scores.values()), default=0)
+    }
     
-    # Расчет результатов
-    results = calculate_final_results(competition_id)
-    
-    return render_template('results.html', 
-                         competition=competition,
-                         results=results)
-
-def calculate_final_results(competition_id):
-    """Расчет финальных результатов"""
-    athletes = Participant.query.all()
-    results = []
-    
-    for athlete in athletes:
-        scores = Score.query.filter_by(
-            competition_id=competition_id,
-            athlete_id=athlete.id
-        ).order_by(Score.round_number).all()
-        
-        if scores:
-            round1 = scores[0].average if len(scores) > 0 else None
-            round2 = scores[1].average if len(scores) > 1 else None
-            round3 = scores[2].average if len(scores) > 2 else None
-            
-            # Сумма лучших двух раундов
-            valid_scores = [s for s in [round1, round2, round3] if s is not None]
-            if len(valid_scores) >= 2:
-                valid_scores.sort(reverse=True)
-                total = sum(valid_scores[:2])
-                average = total / 2
-            else:
-                total = sum(valid_scores) if valid_scores else 0
-                average = total / len(valid_scores) if valid_scores else 0
-            
-            results.append({
-                'athlete_id': athlete.id,
-                'first_name': athlete.first_name,
-                'last_name': athlete.last_name,
-                'club': athlete.club,
-                'category': athlete.category.name if athlete.category else 'Без категории',
-                'round1': round1,
-                'round2': round2,
-                'round3': round3,
-                'total': total,
-                'average': average
-            })
-    
-    # Сортировка по среднему баллу
-    results.sort(key=lambda x: x['average'], reverse=True)
-    
-    # Присвоение мест
-    for i, result in enumerate(results):
-        result['place'] = i + 1
-    
-    return results
-
-@app.route('/export/excel/<int:competition_id>')
-def export_excel(competition_id):
-    results = calculate_final_results(competition_id)
-    competition = Competition.query.get(competition_id)
-    
-    filename = f"results_{competition.name.replace(' ', '_')}.xlsx"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    
-    export_results_to_excel(results, filepath)
-    
-    return send_file(filepath, as_attachment=True)
+    return {'competition': competition_data(competition), 'sections': sections, 'stats': stats}
 
-@app.route('/export/pdf/<int:competition_id>')
-def export_pdf(competition_id):
-    results = calculate_final_results(competition_id)
-    competition = Competition.query.get(competition_id)
-    
-    filename = f"protocol_{competition.name.replace(' ', '_')}.pdf"
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    
-    competition_info = {
+@bp.route('/results/<int:competition_id>/stream')
+def results_stream(competition_id):
+    """Поток изменений таблицы (Server-Sent Events): строки, изменившиеся после ввода оценок.
+    
+    ?category_id=N - только одна категория (0 - без категории). Событие reset означает,
+    что таблица перестроена и ее нужно перечитать. Если процесс уже держит LIVE_MAX_STREAMS
+    потоков, ответ 503 с Retry-After: потоки сервера нужны для ввода оценок.
+    """
+    category_id = request.args.get('category_id', type=int)
+    subscriber = live_results.subscribe(competition_id)
+    if subscriber is None:
+        retry = current_app.config['LIVE_RETRY_SECONDS']
+        return Response('Нет свободных мест для табло, повторите позже', status=503, mimetype='text/plain',
+                        headers={'Retry-After': str(retry)})
+    
+    stream = live_results.stream(subscriber, ALL_CATEGORIES if category_id is None else category_id or None)
+    response = Response(stream, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Отписка при закрытии соединения, даже если поток не успел начаться
+    response.call_on_close(lambda: live_results.unsubscribe(competition_id, subscriber))
+    return response
+
+@bp.route('/results/<int:competition_id>/category/<int:category_id>')
+def category_results(competition_id, category_id):
+    """Результаты категории постранично в порядке мест; category_id=0 - без категории"""
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE)
+    try:
+        rows, next_cursor = results_page(competition_id, category_id or None, request.args.get('after'), limit)
+    except ValueError:
+        abort(400)
+    return jsonify({'rows': rows, 'next': next_cursor})
+
+def get_competition_info(competition):
+    return {
         'name': competition.name,
-        'date': competition.date.strftime('%d.%m.%Y'),
+        'date': competition.start_date.strftime('%d.%m.%Y') if competition.start_date else '',
         'location': competition.location
     }
+
+def build_excel_export(competition, output):
+    from utils.excel_handler import export_results_to_excel
+    # Листы по категориям пишутся последовательно: строки группируются, порядок мест сохраняется
+    results = sorted(calculate_final_results(competition.id), key=lambda result: result['category'])
+    return export_results_to_excel(results, output)
+
+def build_pdf_export(competition, output):
+    from utils.pdf_reporter import generate_results_pdf
+    results = calculate_final_results(competition.id)
+    return generate_results_pdf(results, get_competition_info(competition), output,
+                                workers=current_app.config['PDF_RENDER_WORKERS'],
+                                min_parallel_categories=current_app.config['PDF_PARALLEL_MIN_CATEGORIES'])
+
+def cached_export(competition, kind):
+    """Протокол из дискового кэша; ключ кэша служит ETag"""
+    extension, name_template, build = EXPORTS[kind]
+    key = export_cache.key(kind, competition.id)
+    filepath = export_cache.get_or_build(key, extension, lambda path: build(competition, path))
+    return filepath, key, name_template.format(competition.name.replace(' ', '_'))
+
+def send_rendered(key, filename, build):
+    """Протокол без сохранения в UPLOAD_FOLDER: build(output) пишет в буфер (в памяти,
+    крупный - во временном файле ОС), ответ отдается частями; ETag - отпечаток данных"""
+    if key in request.if_none_match:
+        return '', 304
+    
+    buffer = tempfile.SpooledTemporaryFile(max_size=current_app.config['EXPORT_SPOOL_BYTES'])
+    try:
+        build(buffer)
+    except Exception:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    # send_file закрывает буфер после отправки ответа
+    return send_file(buffer, as_attachment=True, download_name=filename, etag=key, conditional=True)
+
+def stream_export(competition_id, kind):
+    competition = Competition.query.get_or_404(competition_id)
+    extension, name_template, build = EXPORTS[kind]
+    return send_rendered(export_cache.key(kind, competition_id),
+                         name_template.format(competition.name.replace(' ', '_')),
+                         lambda output: build(competition, output))
+
+EXPORTS = {
+    'excel': ('xlsx', 'results_{}.xlsx', build_excel_export),
+    'pdf': ('pdf', 'protocol_{}.pdf', build_pdf_export),
+}
+
+@bp.route('/export/excel/<int:competition_id>')
+def export_excel(competition_id):
+    return stream_export(competition_id, 'excel')
+
+@bp.route('/export/pdf/<int:competition_id>')
+def export_pdf(competition_id):
+    return stream_export(competition_id, 'pdf')
+
+@bp.route('/export/pdf/<int:competition_id>/category/<int:category_id>')
+def export_category_pdf(competition_id, category_id):
+    """Протокол одной категории - можно печатать сразу после ее финального раунда"""
+    competition = Competition.query.get_or_404(competition_id)
+    category = Category.query.filter_by(id=category_id, competition_id=competition_id).first_or_404()
     
-    generate_results_pdf(results, competition_info, filepath)
+    def build(output):
+        from utils.pdf_reporter import generate_category_pdf
+        results = [r for r in calculate_final_results(competition_id) if r['category_id'] == category_id]
+        generate_category_pdf(category.name, results, get_competition_info(competition), output)
     
-    return send_file(filepath, as_attachment=True)
+    filename = f"protocol_{competition.name.replace(' ', '_')}_{category.name.replace(' ', '_')}.pdf"
+    return send_rendered(export_cache.key(f'pdf-category{category_id}', competition_id), filename, build)
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Создание недостающих таблиц и индексов в существующей БД"""
+    db.create_all()
+    created = upgrade_schema()
+    click.echo(f"Созданы индексы: {', '.join(created)}" if created else 'Схема актуальна')
+
+@bp.cli.command('explain-routes')
+@click.argument('competition_id', type=int)
+def explain_routes_command(competition_id):
+    """EXPLAIN QUERY PLAN для запросов основных страниц соревнования"""
+    full_scans = 0
+    for url, plans in audit_routes(current_app._get_current_object(), competition_id).items():
+        click.echo(f'== {url}')
+        for statement, plan, full_scan in plans:
+            full_scans += full_scan
+            click.echo(('  [SCAN] ' if full_scan else '  ') + ' '.join(statement.split())[:150])
+            for line in plan:
+                click.echo(f'      {line}')
+    click.echo(f'Запросов с полным проходом по таблице: {full_scans}')
+
+# Фоновые задачи
+@job_queue.handler('import_participants')
+def import_participants_job(job, file_path, competition_id, deactivate_missing=False):
+    from utils.excel_handler import sync_participants
+
+    def on_progress(processed, total):
+        percent = min(99, processed * 100 // total) if total else 0
+        job_queue.report(job.id, percent, f'Обработано строк: {processed}')
+
+    # Загрузка сравнивается с уже загруженным составом: повторная загрузка меняет только отличия
+    try:
+        report = sync_participants(file_path, competition_id, chunk_size=current_app.config['IMPORT_CHUNK_SIZE'],
+                                   on_progress=on_progress, deactivate_missing=deactivate_missing)
+        if report['inserted'] or report['updated'] or report['deactivated']:
+            Competition.query.filter_by(id=competition_id).update({'categories_stale': True})
+            response_cache.invalidate(competition_id)
+        if report['updated'] or report['deactivated']:
+            # Отключенные спортсмены выбывают из таблицы, как и из calculate_final_results
+            rebuild_standings(competition_id, commit=False)
+        db.session.commit()
+    finally:
+        os.remove(file_path)
+    logger.info(f"Загрузка состава соревнования {competition_id}: добавлено {report['inserted']}, "
+                f"обновлено {report['updated']}, отключено {report['deactivated']}, без изменений {report['unchanged']}")
+    return {'inserted': report['inserted'],
+            'updated': report['updated'],
+            'deactivated': report['deactivated'],
+            'unchanged': report['unchanged'],
+            'changes': report['changes'][:MAX_REPORTED_ERRORS],
+            'changes_count': len(report['changes']),
+            'errors': report['errors'][:MAX_REPORTED_ERRORS],
+            'errors_count': len(report['errors'])}
+
+@job_queue.handler('export_excel')
+def export_excel_job(job, competition_id):
+    competition = db.session.get(Competition, competition_id)
+    filepath, key, filename = cached_export(competition, 'excel')
+    return {'file': filepath, 'filename': filename, 'etag': key}
+
+@job_queue.handler('export_pdf')
+def export_pdf_job(job, competition_id):
+    competition = db.session.get(Competition, competition_id)
+    filepath, key, filename = cached_export(competition, 'pdf')
+    return {'file': filepath, 'filename': filename, 'etag': key}
+
+@bp.route('/export/<kind>/<int:competition_id>/job', methods=['POST'])
+def start_export_job(kind, competition_id):
+    """Запуск экспорта в фоне; клиент опрашивает статус задачи"""
+    if kind not in ('excel', 'pdf'):
+        return jsonify({'error': 'Неизвестный формат'}), 404
+    Competition.query.get_or_404(competition_id)
+    job = job_queue.submit(f'export_{kind}', competition_id=competition_id)
+    return jsonify({'id': job.id,
+                    'status_url': url_for('main.job_status', job_id=job.id),
+                    'download_url': url_for('main.job_download', job_id=job.id)}), 202
+
+@bp.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    return jsonify(job_queue.status(job))
+
+@bp.route('/jobs/<int:job_id>/download')
+def job_download(job_id):
+    job = Job.query.get_or_404(job_id)
+    result = json.loads(job.result) if job.result else {}
+    if job.status != 'done' or 'file' not in result:
+        return jsonify(job_queue.status(job)), 409
+    if not os.path.exists(result['file']):
+        # Файл вытеснен из кэша экспорта - протокол нужно запросить заново
+        return jsonify({'error': 'Файл удален из кэша'}), 410
+    return send_file(result['file'], as_attachment=True, download_name=result['filename'],
+                     etag=result.get('etag'), conditional=True)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Отладочный сервер для разработки; на соревнованиях - wsgi.py (gunicorn или waitress)
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,92 @@
+"""Нагрузка параллельным вводом оценок через /enter_scores.
+
+Имитирует несколько судейских планшетов, одновременно отправляющих оценки.
+Сравнение с профилем SQLite и без него:
+
+    python -m benchmarks.bench_concurrency --threads 8 --requests 200
+    SQLITE_TUNING=0 python -m benchmarks.bench_concurrency --threads 8 --requests 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def run(threads, requests_per_thread, athletes=500):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+
+    from app import create_app
+    from database import db
+    from models import Competition, Participant
+
+    app = create_app()
+
+    with app.app_context():
+        db.session.add(Competition(name='Бенчмарк'))
+        db.session.flush()
+        db.session.add_all(Participant(first_name='Имя', last_name=f'Спортсмен {i}', competition_id=1)
+                           for i in range(athletes))
+        db.session.commit()
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def judge_tablet(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for _ in range(requests_per_thread):
+            payload = {
+                'athlete_id': rng.randint(1, athletes),
+                'round_number': rng.randint(1, 3),
+                'scores': [round(rng.uniform(5, 10), 1) for _ in range(5)]
+            }
+            started = time.perf_counter()
+            try:
+                response = client.post('/enter_scores', json=payload)
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures.append(payload)
+
+    workers = [threading.Thread(target=judge_tablet, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'journal_mode': journal_mode,
+        'requests': len(latencies),
+        'failures': len(failures),
+        'throughput_rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='Запросов на поток')
+    args = parser.parse_args()
+    stats = run(args.threads, args.requests)
+    print(f"journal_mode={stats['journal_mode']}: {stats['requests']} запросов, ошибок {stats['failures']}, "
+          f"{stats['throughput_rps']:.0f} запросов/с, p50 {stats['p50_ms']:.1f} мс, p99 {stats['p99_ms']:.1f} мс")
@@ -0,0 +1,85 @@
+"""Замер скорости импорта спортсменов из Excel.
+
+Фикстура строится размножением строк из Книга1.xlsx до нужного размера:
+
+    python -m benchmarks.bench_import --rows 10000 [--streaming] [--memory]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import db
+from utils.excel_handler import (import_participants_from_excel, import_and_insert_participants,
+                                 bulk_insert_participants)
+
+SAMPLE_FILE = os.path.join(ROOT, 'Книга1.xlsx')
+
+
+def build_fixture(rows, path):
+    """Excel файл на rows строк на основе примера"""
+    sample = pd.read_excel(SAMPLE_FILE)
+    repeats = rows // len(sample) + 1
+    df = pd.concat([sample] * repeats, ignore_index=True).head(rows)
+    df['Номер'] = range(1, rows + 1)
+    df.to_excel(path, index=False)
+    return path
+
+
+def run(rows, streaming=False, trace_memory=False):
+    workdir = tempfile.mkdtemp()
+    fixture = build_fixture(rows, os.path.join(workdir, 'roster.xlsx'))
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        if streaming:
+            _, errors = import_and_insert_participants(fixture, 1)
+            parsed = started
+        else:
+            participants, errors = import_participants_from_excel(fixture, 1)
+            parsed = time.perf_counter()
+            bulk_insert_participants(participants)
+        db.session.commit()
+        finished = time.perf_counter()
+        peak_memory = 0
+        if trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    return {
+        'rows': rows,
+        'streaming': streaming,
+        'errors': len(errors),
+        'parse_seconds': parsed - started,
+        'insert_seconds': finished - parsed,
+        'rows_per_second': rows / (finished - started),
+        'peak_memory_mb': peak_memory / 2 ** 20
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--streaming', action='store_true', help='Потоковое чтение через openpyxl')
+    parser.add_argument('--memory', action='store_true', help='Замер пика памяти (tracemalloc, замедляет прогон)')
+    args = parser.parse_args()
+    stats = run(args.rows, args.streaming, args.memory)
+    print(f"{stats['rows']} строк: чтение {stats['parse_seconds']:.2f} с, "
+          f"вставка {stats['insert_seconds']:.2f} с, {stats['rows_per_second']:.0f} строк/с, "
+          f"пик памяти {stats['peak_memory_mb']:.1f} МБ, ошибок {stats['errors']}")
@@ -0,0 +1,72 @@
+"""Время импорта app.py по данным python -X importtime.
+
+Замер выполняется в отдельном процессе (модули не должны быть уже загружены).
+Код возврата 1, если импорт дольше бюджета или подтянул тяжелые модули
+импорта/экспорта, которые должны загружаться только при первом использовании:
+
+    python -m benchmarks.bench_startup [--budget-ms 1000] [--runs 5] [--top 15]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые не должны загружаться при импорте приложения
+LAZY_MODULES = ('pandas', 'openpyxl', 'reportlab', 'xlsxwriter', 'pypdf')
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)')
+
+
+def import_profile():
+    """[(модуль, собственное время мкс, накопленное мкс, уровень вложенности)] одного холодного импорта"""
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'startup.db')}", PYTHONPATH=ROOT)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                               cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    profile = []
+    for line in completed.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            profile.append((module, int(own), int(cumulative), len(indent) // 2))
+    return profile
+
+
+def run(runs):
+    totals = []
+    for _ in range(runs):
+        profile = import_profile()
+        totals.append(next(cumulative for module, _, cumulative, _ in profile if module == 'app'))
+    loaded = {module for module, *_ in profile}
+    return {
+        'runs': runs,
+        'median_ms': statistics.median(totals) / 1000,
+        'min_ms': min(totals) / 1000,
+        'heavy_modules': sorted(module for module in LAZY_MODULES if module in loaded),
+        'top': sorted(((module, cumulative / 1000) for module, _, cumulative, level in profile
+                       if level == 1), key=lambda item: -item[1])
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=1000, help='Допустимое время импорта app (медиана)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Сколько самых долгих прямых импортов показать')
+    args = parser.parse_args()
+
+    stats = run(args.runs)
+    for module, milliseconds in stats['top'][:args.top]:
+        print(f'{module:<40} {milliseconds:8.1f} мс')
+    print(f"import app: медиана {stats['median_ms']:.0f} мс, минимум {stats['min_ms']:.0f} мс, "
+          f"бюджет {args.budget_ms:.0f} мс")
+
+    failed = stats['median_ms'] > args.budget_ms
+    if stats['heavy_modules']:
+        print(f"При импорте загружены тяжелые модули: {', '.join(stats['heavy_modules'])}")
+        failed = True
+    sys.exit(1 if failed else 0)
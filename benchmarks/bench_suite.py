@@ -0,0 +1,181 @@
+"""Набор замеров ключевых операций на синтетическом соревновании.
+
+Каждый прогон пишет JSON (параметры, окружение, время по операциям), который можно
+сравнить с прошлым прогоном, например перед днем соревнований:
+
+    python -m benchmarks.bench_suite --athletes 2000 --categories 16 --output before.json
+    python -m benchmarks.bench_suite --athletes 2000 --categories 16 --baseline before.json
+
+С --baseline код возврата 1, если медиана какой-либо операции выросла больше чем на --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def measure(function, repeat, setup=None):
+    """Время function() в секундах для repeat прогонов; setup() перед каждым прогоном не замеряется"""
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append(time.perf_counter() - started)
+    return {
+        'runs': repeat,
+        'min_seconds': min(timings),
+        'median_seconds': statistics.median(timings),
+        'mean_seconds': statistics.fmean(timings)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(athletes, categories, rounds, judges, repeat, score_requests, seed=0):
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)
+
+    from app import create_app
+    from database import db
+    from models import Category, Participant
+    from benchmarks.synthetic import REFERENCE_DATE, seed_competition, write_roster
+    from utils.draw_generator import categorize_athletes, generate_draw
+    from utils.excel_handler import import_and_insert_participants, export_results_to_excel
+    from utils.pdf_reporter import generate_results_pdf
+    from utils.results import calculate_final_results
+    from utils.scoring import scoring_rule
+
+    app = create_app()
+    client = app.test_client()
+
+    cases = {}
+    with app.app_context():
+        started = time.perf_counter()
+        competition_id = seed_competition(athletes, categories, rounds, judges, seed)
+        seed_seconds = time.perf_counter() - started
+        info = {'name': 'Бенчмарк', 'date': REFERENCE_DATE.strftime('%d.%m.%Y'), 'location': 'Синтетика'}
+
+        roster = write_roster(os.path.join(workdir, 'roster.xlsx'), athletes, seed, prefix='I')
+
+        def import_roster():
+            import_and_insert_participants(roster, competition_id)
+            db.session.commit()
+
+        def remove_imported(_=None):
+            # Номера участников уникальны - импортированные строки удаляются перед следующим прогоном
+            Participant.query.filter(Participant.registration_number.like('I%')).delete(synchronize_session=False)
+            db.session.commit()
+
+        cases['excel_import'] = measure(lambda _: import_roster(), repeat, setup=remove_imported)
+        remove_imported()
+
+        participants = Participant.query.filter_by(competition_id=competition_id).all()
+        category_list = Category.query.filter_by(competition_id=competition_id).all()
+        cases['categorize_athletes'] = measure(
+            lambda: categorize_athletes(participants, category_list, REFERENCE_DATE), repeat)
+        db.session.rollback()
+
+        by_category = defaultdict(list)
+        for participant in participants:
+            by_category[participant.category_id].append(participant)
+        cases['generate_draw'] = measure(lambda: generate_draw(by_category, seed), repeat)
+
+        cases['calculate_final_results'] = measure(lambda: calculate_final_results(competition_id), repeat)
+        results = calculate_final_results(competition_id)
+
+        cases['export_excel'] = measure(
+            lambda: export_results_to_excel(results, os.path.join(workdir, 'results.xlsx')), repeat)
+        cases['export_pdf'] = measure(
+            lambda: generate_results_pdf(results, info, os.path.join(workdir, 'results.pdf')), repeat)
+        participant_ids = [participant.id for participant in participants]
+
+    # Последовательный ввод оценок через HTTP-обработчик (без сети, через тестовый клиент)
+    def enter_scores():
+        for number in range(score_requests):
+            scores = [7.5 + (number + judge) % 5 * 0.5 if judge < judges else None
+                      for judge in range(len(scoring_rule.judge_fields))]
+            response = client.post('/enter_scores', json={
+                'athlete_id': participant_ids[number % len(participant_ids)],
+                'round_number': number % 3 + 1,
+                'scores': scores
+            })
+            assert response.status_code == 200, response.status_code
+
+    cases['enter_scores'] = measure(enter_scores, repeat)
+    cases['enter_scores']['requests_per_second'] = score_requests / cases['enter_scores']['median_seconds']
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'sqlite_tuning': app.config['SQLITE_TUNING']},
+        'parameters': {'athletes': athletes, 'categories': categories, 'rounds': rounds, 'judges': judges,
+                       'repeat': repeat, 'score_requests': score_requests, 'seed': seed},
+        'seed_seconds': seed_seconds,
+        'cases': cases
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Операции, медиана которых выросла больше чем на tolerance: [(операция, было, стало)]"""
+    if baseline.get('parameters') != report['parameters']:
+        print('Внимание: параметры прогона отличаются от базового')
+    regressions = []
+    for name, stats in report['cases'].items():
+        previous = baseline.get('cases', {}).get(name)
+        if previous and stats['median_seconds'] > previous['median_seconds'] * (1 + tolerance):
+            regressions.append((name, previous['median_seconds'], stats['median_seconds']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--athletes', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--judges', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3, help='Прогонов каждой операции')
+    parser.add_argument('--score-requests', type=int, default=200, help='Запросов /enter_scores за прогон')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Куда записать JSON с результатами')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Допустимый рост медианы (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # Пути указываются относительно текущего каталога, а run переходит во временный
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    report = run(args.athletes, args.categories, args.rounds, args.judges, args.repeat,
+                 args.score_requests, args.seed)
+    for name, stats in report['cases'].items():
+        print(f"{name:<24} медиана {stats['median_seconds'] * 1000:9.1f} мс, минимум {stats['min_seconds'] * 1000:9.1f} мс")
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, before, after in regressions:
+            print(f'Замедление {name}: {before * 1000:.1f} мс -> {after * 1000:.1f} мс')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,110 @@
+"""Синтетические соревнования заданного масштаба для бенчмарков.
+
+Данные детерминированы параметром seed: два прогона с одинаковыми параметрами
+работают с одинаковыми спортсменами, клубами и оценками.
+"""
+import random
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from database import db
+from models import Competition, Category, Participant, Score
+from utils.draw_generator import assign_categories
+from utils.excel_handler import COLUMNS, bulk_insert_participants
+from utils.scoring import scoring_rule
+from utils.standings import rebuild_standings
+
+FIRST_NAMES = ['Анна', 'Мария', 'Дарья', 'Иван', 'Петр', 'Алексей', 'Софья', 'Егор', 'Полина', 'Артем']
+LAST_NAMES = ['Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков']
+REFERENCE_DATE = date(2026, 5, 1)
+MIN_AGE, MAX_AGE = 6, 30
+
+
+def athlete_rows(athletes, clubs=40, seed=0, prefix='B'):
+    """Словари полей Participant (без competition_id); registration_number - prefix + номер"""
+    rng = random.Random(seed)
+    rows = []
+    for number in range(athletes):
+        gender = rng.choice('мж')
+        last_name = rng.choice(LAST_NAMES) + ('а' if gender == 'ж' else '')
+        age = rng.randint(MIN_AGE, MAX_AGE)
+        rows.append({
+            'last_name': last_name,
+            'first_name': rng.choice(FIRST_NAMES),
+            'second_name': None,
+            'birth_date': date(REFERENCE_DATE.year - age - 1, rng.randint(1, 12), rng.randint(1, 28)),
+            'gender': gender,
+            'club': f'Клуб {rng.randrange(clubs)}',
+            'registration_number': f'{prefix}{number + 1}'
+        })
+    return rows
+
+
+def category_bounds(categories):
+    """Возрастные диапазоны: categories категорий, поровну на каждый пол"""
+    per_gender = max(1, categories // 2)
+    ages = np.array_split(np.arange(MIN_AGE, MAX_AGE + 1), per_gender)
+    bounds = []
+    for gender in ('м', 'ж'):
+        for band in ages:
+            bounds.append((gender, int(band[0]), int(band[-1])))
+    return bounds[:categories]
+
+
+def write_roster(path, athletes, seed=0, prefix='B'):
+    """Excel файл заявки в формате импорта"""
+    fields = {field: column for column, field in COLUMNS.items()}
+    df = pd.DataFrame(athlete_rows(athletes, seed=seed, prefix=prefix)).rename(columns=fields)
+    df['Дата рождения'] = df['Дата рождения'].map(lambda value: value.strftime('%d.%m.%Y'))
+    df.to_excel(path, index=False)
+    return path
+
+
+def score_rows(participant_ids, rounds, judges, seed=0):
+    """Оценки rounds раундов: judges первых судей выставляют оценку, остальные поля пустые"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for round_number in range(1, rounds + 1):
+        matrix = np.full((len(participant_ids), len(scoring_rule.judge_fields)), np.nan)
+        matrix[:, :judges] = np.round(rng.uniform(5, 10, (len(participant_ids), judges)), 1)
+        totals = scoring_rule.totals(matrix)
+        for participant_id, scores, total in zip(participant_ids, matrix.tolist(), totals):
+            row = {'participant_id': participant_id, 'round_number': round_number,
+                   'total': None if np.isnan(total) else float(total)}
+            row.update((field, None if np.isnan(value) else value)
+                       for field, value in zip(scoring_rule.judge_fields, scores))
+            rows.append(row)
+    return rows
+
+
+def seed_competition(athletes=1000, categories=12, rounds=3, judges=5, seed=0, prefix='B'):
+    """Соревнование с категориями, спортсменами и оценками в текущей БД; возвращает id"""
+    if not 1 <= judges <= len(scoring_rule.judge_fields):
+        raise ValueError(f'Судей должно быть от 1 до {len(scoring_rule.judge_fields)}')
+    if not 0 <= rounds <= 3:
+        raise ValueError('Раундов должно быть от 0 до 3')
+
+    competition = Competition(name=f'Бенчмарк {athletes}', location='Синтетика',
+                              start_date=pd.Timestamp(REFERENCE_DATE).to_pydatetime())
+    db.session.add(competition)
+    db.session.flush()
+
+    for gender, min_age, max_age in category_bounds(categories):
+        db.session.add(Category(competition_id=competition.id, name=f'{gender} {min_age}-{max_age}',
+                                min_age=min_age, max_age=max_age, gender=gender))
+
+    rows = athlete_rows(athletes, seed=seed, prefix=prefix)
+    for row in rows:
+        row['competition_id'] = competition.id
+    bulk_insert_participants(rows)
+    assign_categories(competition)
+
+    participant_ids = [pid for pid, in db.session.query(Participant.id)
+                       .filter_by(competition_id=competition.id).order_by(Participant.id)]
+    if rounds:
+        db.session.execute(db.insert(Score), score_rows(participant_ids, rounds, judges, seed))
+    db.session.commit()
+    rebuild_standings(competition.id)
+    return competition.id
@@ -7,6 +7,55 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key-here'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///competition.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Профиль производительности SQLite: PRAGMA выполняются на каждом новом подключении
+    SQLITE_TUNING = os.environ.get('SQLITE_TUNING', '1') != '0'
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',  # читатели не блокируют писателя
+        'busy_timeout': 5000,  # мс ожидания блокировки вместо "database is locked"
+        'synchronous': 'NORMAL',  # в режиме WAL fsync только при checkpoint
+        'cache_size': -64000,  # 64MB кэша страниц на подключение
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # Пул подключений для многопоточного сервера (только для файловой БД)
+    SQLITE_POOL = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'connect_args': {'check_same_thread': False, 'timeout': 5},
+    }
+
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
-    ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+    IMPORT_CHUNK_SIZE = 1000  # строк на пачку при потоковом импорте
+    SCORING_JUDGE_FIELDS = ['judge1', 'judge2', 'judge3', 'judge4', 'referee']  # поля Score с оценками судей, в порядке ввода
+    SCORING_TRIM = 1  # сколько крайних оценок отбрасывается с каждой стороны
+    SCORING_BEST_ROUNDS = 2  # сколько лучших раундов идет в зачет
+    JOB_WORKERS = 4  # потоков в пуле фоновых задач
+    JOB_LIMITS = {'import_participants': 1, 'export_pdf': 2}  # одновременных задач по типу (во всех процессах)
+    JOB_HEARTBEAT_SECONDS = 2  # как часто процесс отмечает свои задачи и их прогресс в БД
+    JOB_STALE_SECONDS = 60  # задача без отметки дольше этого считается брошенной и перезапускается
+    EXPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200MB готовых протоколов на диске
+    EXPORT_SPOOL_BYTES = 8 * 1024 * 1024  # протокол до 8MB собирается в памяти, больше - во временном файле ОС
+    PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS') or os.cpu_count() or 1)  # процессов верстки PDF; под gunicorn - ядра, деленные на воркеров
+    PDF_PARALLEL_MIN_CATEGORIES = 8  # с какого числа категорий верстать протокол параллельно
+    LIVE_HEARTBEAT_SECONDS = 15  # пинг открытых потоков результатов, чтобы прокси не закрывали соединение
+    LIVE_QUEUE_SIZE = 100  # непрочитанных обновлений на подписчика, дальше - команда перечитать таблицу
+    LIVE_POLL_SECONDS = 1  # как часто потоки результатов проверяют изменения из других процессов
+    # Открытых потоков результатов на процесс (0 - без ограничения): каждый держит поток сервера,
+    # остальные потоки остаются для ввода оценок; gunicorn.conf.py задает половину WEB_THREADS
+    LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS') or 0)
+    LIVE_RETRY_SECONDS = 30  # через сколько табло повторяет подключение, если мест нет
+    MAT_COUNT = 2  # ковров по умолчанию при составлении расписания
+    MAT_SECONDS_PER_PERFORMANCE = 60  # оценка длительности выступления до появления фактических оценок
+    MAT_CHANGEOVER_SECONDS = 120  # смена категории на ковре
+    MAT_PACE_MIN_SAMPLES = 5  # после стольких оценок категории ее темп берется из фактических времен
+    MAT_AGE_ORDER = True  # младшие возрастные группы начинают раньше старших
+    RESPONSE_CACHE_SIZE = 256  # записей в кэше данных страниц
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'  # замеры маршрутов и SQL, переключаются через POST /metrics
+    METRICS_N_PLUS_ONE_THRESHOLD = 10  # одинаковых SELECT за запрос, после которых пишется предупреждение
+    METRICS_SLOW_REQUEST_MS = 1000  # запросы дольше этого попадают в лог
+    METRICS_SYNC_SECONDS = 2  # как часто процесс перечитывает общий переключатель метрик из БД
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # доступ к /metrics по заголовку X-Metrics-Token; без него - только локально без прокси
\ No newline at end of file
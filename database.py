@@ -1,3 +1,34 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+
+def init_db(app):
+    """Подключение БД к приложению с профилем SQLite из конфигурации"""
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    tuned = app.config.get('SQLITE_TUNING') and is_sqlite_file(uri)
+    if tuned:
+        options = dict(app.config['SQLITE_POOL'])
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    db.init_app(app)
+
+    if tuned:
+        with app.app_context():
+            event.listen(db.engine, 'connect', pragma_listener(app.config['SQLITE_PRAGMAS']))
+
+
+def is_sqlite_file(uri):
+    """Файловая SQLite (для базы в памяти пул и WAL не применяются)"""
+    return uri.startswith('sqlite') and ':memory:' not in uri and uri.rstrip('/') != 'sqlite:'
+
+
+def pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return set_pragmas
@@ -0,0 +1,35 @@
+"""Настройки gunicorn для соревнований: gunicorn -c gunicorn.conf.py wsgi:app
+
+Переопределяются переменными окружения BIND, WEB_CONCURRENCY (процессов), WEB_THREADS,
+LIVE_MAX_STREAMS (табло на процесс), PDF_RENDER_WORKERS (процессов верстки PDF на воркер).
+
+Емкость: открытое табло (Server-Sent Events) держит поток воркера до закрытия страницы.
+Процесс принимает не больше LIVE_MAX_STREAMS табло (по умолчанию половина WEB_THREADS),
+остальные получают 503 и переподключаются позже, поэтому ввод оценок всегда находит
+свободный поток. При WEB_CONCURRENCY=4 и WEB_THREADS=16 это 32 табло. Закрытое табло
+освобождает место, когда на его соединение не пройдет пинг (до 2 x LIVE_HEARTBEAT_SECONDS). Если табло больше,
+потоки результатов выносятся на отдельный экземпляр (см. wsgi.py).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count())
+# Потоки, а не gevent: пулы фоновых задач и PDF, поток опроса версий и вызовы SQLite
+# рассчитаны на настоящие потоки. Часть потоков занимают табло - их число ограничено
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS') or 16)
+# Воркеры наследуют окружение мастера: Config читает LIVE_MAX_STREAMS из него
+os.environ.setdefault('LIVE_MAX_STREAMS', str(max(1, threads // 2)))
+# Ядра делятся между воркерами: у каждого свой пул верстки PDF (PDF_RENDER_WORKERS процессов)
+os.environ.setdefault('PDF_RENDER_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+timeout = 120
+# Приложение создается в каждом воркере: подключения к SQLite и пулы потоков не переживают fork
+preload_app = False
+
+
+def on_starting(server):
+    """Обработчик лога с очередью подключается в мастер-процессе до запуска воркеров:
+    воркеры наследуют его, и файл лога пишет и ротирует один процесс."""
+    from app import init_logging
+    init_logging()
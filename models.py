@@ -1,5 +1,6 @@
 from datetime import datetime
 from database import db
+from utils.scoring import scoring_rule
 
 
 class Competition(db.Model):
@@ -12,11 +13,15 @@ class Competition(db.Model):
     end_date = db.Column(db.DateTime)
     location = db.Column(db.String(200))
     status = db.Column(db.String(20), default='pending')  # pending, active, completed
+    categories_stale = db.Column(db.Boolean, default=True)  # распределение по категориям нужно пересчитать
 
     categories = db.relationship('Category', backref='competition', lazy=True, cascade='all, delete-orphan')
 
 class Category(db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        db.Index('ix_categories_competition', 'competition_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     competition_id = db.Column(db.Integer, db.ForeignKey('competitions.id'), nullable=False)
@@ -26,9 +31,18 @@ class Category(db.Model):
     gender = db.Column(db.String(10))
     
     participants  = db.relationship('Participant', backref='category', lazy=True)
+    draw = db.relationship('Draw', backref='category', uselist=False, cascade='all, delete-orphan')
+    mat_slot = db.relationship('MatSlot', backref='category', uselist=False, cascade='all, delete-orphan')
 
 class Participant(db.Model):
     __tablename__ = 'participants'
+    __table_args__ = (
+        # Участники соревнования по категориям (результаты, страницы категорий)
+        db.Index('ix_participants_competition_category', 'competition_id', 'category_id'),
+        # Подбор участников в категорию по полу и возрасту
+        db.Index('ix_participants_competition_gender_age', 'competition_id', 'gender', 'age'),
+        db.Index('ix_participants_category', 'category_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
@@ -59,6 +73,10 @@ class Participant(db.Model):
 
 class Score(db.Model):
     __tablename__ = 'scores'
+    __table_args__ = (
+        # Одна запись на раунд: поиск оценки при вводе - один проход по индексу
+        db.Index('uq_scores_participant_round', 'participant_id', 'round_number', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     participant_id  = db.Column(db.Integer, db.ForeignKey('participants.id'), nullable=False)
@@ -70,11 +88,98 @@ class Score(db.Model):
     referee = db.Column(db.Float)
     total = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    scored_at = db.Column(db.DateTime)  # когда раунд впервые оценен (время выступления), исправления не меняют
     
     def calculate_scores(self):
-        scores = [self.judge1, self.judge2, self.judge3, self.judge4, self.referee]
-        valid_scores = [s for s in scores if s is not None]
-        if valid_scores:
-            valid_scores.sort()
-            valid_scores = valid_scores[1:-1]  # Убираем мин и макс
-            self.total = sum(valid_scores)
\ No newline at end of file
+        # Убираем крайние оценки по правилу подсчета (SCORING_TRIM)
+        self.total = scoring_rule.round_total([getattr(self, field) for field in scoring_rule.judge_fields])
+        if self.total is not None and self.scored_at is None:
+            self.scored_at = datetime.utcnow()
+
+class Standing(db.Model):
+    __tablename__ = 'standings'
+    __table_args__ = (
+        db.Index('ix_standings_group', 'competition_id', 'category_id', 'average'),
+        db.Index('ix_standings_version', 'competition_id', 'version'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    competition_id = db.Column(db.Integer, db.ForeignKey('competitions.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
+    participant_id = db.Column(db.Integer, db.ForeignKey('participants.id'), nullable=False, unique=True)
+    round1 = db.Column(db.Float)
+    round2 = db.Column(db.Float)
+    round3 = db.Column(db.Float)
+    total = db.Column(db.Float, default=0)
+    average = db.Column(db.Float, default=0)
+    place = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer)  # версия данных соревнования (data_versions) последней записи строки
+
+
+
+class Draw(db.Model):
+    __tablename__ = 'draws'
+    __table_args__ = (
+        db.Index('ix_draws_competition', 'competition_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    competition_id = db.Column(db.Integer, db.ForeignKey('competitions.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False, unique=True)
+    seed = db.Column(db.String(64), nullable=False)
+    participant_ids = db.Column(db.Text, nullable=False)  # порядок выступления: id участников через запятую
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MatSlot(db.Model):
+    """Место категории в расписании ковров: номер ковра (с 0) и порядок на нем"""
+    __tablename__ = 'mat_slots'
+    __table_args__ = (
+        db.Index('ix_mat_slots_competition', 'competition_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    competition_id = db.Column(db.Integer, db.ForeignKey('competitions.id'), nullable=False)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=False, unique=True)
+    mat = db.Column(db.Integer, nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, running, done, failed
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    worker = db.Column(db.String(100))  # процесс, выполняющий задачу (хост:pid)
+    heartbeat_at = db.Column(db.DateTime)  # отметка жизни выполняющего процесса
+    progress = db.Column(db.Integer)  # прогресс на момент последней отметки, для других процессов
+    message = db.Column(db.String(200))
+
+
+class DataVersion(db.Model):
+    """Счетчик изменений данных соревнования, общий для всех процессов сервера.
+
+    scope - id соревнования или 'all' (любое изменение). По нему процессы узнают,
+    что их кэши в памяти устарели из-за записи в другом процессе.
+    'rebuild:<id>' - версия последнего перестроения таблицы соревнования.
+    """
+    __tablename__ = 'data_versions'
+
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Setting(db.Model):
+    """Параметр, переключаемый на лету и общий для всех процессов сервера"""
+    __tablename__ = 'settings'
+
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
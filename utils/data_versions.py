@@ -0,0 +1,94 @@
+import threading
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db
+from models import DataVersion
+
+PENDING_KEY = 'data_versions'
+ALL_COMPETITIONS = 'all'
+REBUILD_SCOPE = 'rebuild:{}'
+
+
+class DataVersions:
+    """Версии данных соревнований в таблице data_versions.
+
+    Таблица общая для всех процессов сервера, поэтому кэши в памяти каждого
+    процесса сверяют с ней свои данные: изменение, записанное другим процессом,
+    видно по выросшей версии. bump выполняется в транзакции изменения и сразу
+    берет блокировку записи SQLite, поэтому версии растут строго по порядку commit.
+    После commit подписчики on_commit получают {id соревнования: новая версия}.
+
+    Отдельно хранится версия последнего полного перестроения данных соревнования
+    (mark_rebuild): по ней процесс отличает перестроение от точечных изменений.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_soft_rollback', self._after_rollback)
+
+    def on_commit(self, listener):
+        """listener(versions) вызывается после commit транзакции, изменившей версии"""
+        with self._lock:
+            if listener not in self._listeners:
+                self._listeners.append(listener)
+
+    def bump(self, competition_id=ALL_COMPETITIONS):
+        """Версия соревнования (и ALL_COMPETITIONS) растет в текущей транзакции, один раз за транзакцию.
+
+        Возвращает новую версию соревнования.
+        """
+        pending = db.session.info.setdefault(PENDING_KEY, {})
+        table = DataVersion.__table__
+        for scope in dict.fromkeys([competition_id, ALL_COMPETITIONS]):
+            if scope not in pending:
+                pending[scope] = db.session.execute(
+                    sqlite_insert(table).values(scope=str(scope), version=1)
+                    .on_conflict_do_update(index_elements=[table.c.scope], set_={'version': table.c.version + 1})
+                    .returning(table.c.version)).scalar()
+        return pending[competition_id]
+
+    def mark_rebuild(self, competition_id):
+        """Данные соревнования перестраиваются целиком в текущей транзакции"""
+        version = self.bump(competition_id)
+        table = DataVersion.__table__
+        db.session.execute(
+            sqlite_insert(table).values(scope=REBUILD_SCOPE.format(competition_id), version=version)
+            .on_conflict_do_update(index_elements=[table.c.scope], set_={'version': version}))
+        return version
+
+    def current(self, competition_id=ALL_COMPETITIONS, session=None):
+        """Последняя зафиксированная версия (0 - изменений еще не было)"""
+        session = session or db.session
+        table = DataVersion.__table__
+        return session.execute(
+            select(table.c.version).where(table.c.scope == str(competition_id))).scalar() or 0
+
+    def current_many(self, competition_ids, session, scope_format='{}'):
+        """{id соревнования: версия} одним запросом; scope_format=REBUILD_SCOPE - версии перестроений"""
+        table = DataVersion.__table__
+        scopes = {scope_format.format(competition_id): competition_id for competition_id in competition_ids}
+        versions = dict.fromkeys(competition_ids, 0)
+        for scope, version in session.execute(
+                select(table.c.scope, table.c.version).where(table.c.scope.in_(scopes))):
+            versions[scopes[scope]] = version
+        return versions
+
+    def _after_commit(self, session):
+        versions = session.info.pop(PENDING_KEY, None)
+        if not versions:
+            return
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(versions)
+
+    def _after_rollback(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(PENDING_KEY, None)
+
+
+data_versions = DataVersions()
@@ -1,29 +1,187 @@
+import heapq
 import random
+from bisect import bisect_right
 from datetime import datetime
-from models import Participant, Category
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from database import db
+from models import Participant, Category, Draw
 
-def categorize_athletes(athletes, categories):
+NO_CATEGORY = 'Без категории'
+
+
+class CategoryIndex:
+    """Индекс категорий для распределения спортсменов.
+
+    Категории разбиты по полу (категории без пола попадают во все корзины), а
+    возрастная ось каждой корзины разрезана на элементарные интервалы, в каждом из
+    которых заранее выбрана подходящая категория - первая по порядку, как и при
+    полном переборе. Поиск категории для спортсмена - один bisect: O(log C).
+    """
+
+    def __init__(self, categories):
+        categories = list(categories)
+        genders = {c.gender for c in categories if c.gender}
+        self.buckets = {gender: self._build([c for c in categories if not c.gender or c.gender == gender])
+                        for gender in genders}
+        self.mixed = self._build([c for c in categories if not c.gender])
+
+    @staticmethod
+    def _build(categories):
+        """Границы интервалов и категория-победитель для каждого интервала"""
+        # Пустая граница (None или 0) означает отсутствие ограничения, как в matches_category
+        bounds = [(c.min_age or None, c.max_age or None, c) for c in categories]
+        points = sorted({low for low, _, _ in bounds if low is not None} |
+                        {high + 1 for _, high, _ in bounds if high is not None})
+        starts = [float('-inf')] + points
+        winners = []
+        for start in starts:
+            # Любой возраст интервала [start, следующая граница) ведет себя одинаково
+            age = start if start != float('-inf') else (points[0] - 1 if points else 0)
+            winners.append(next((c for low, high, c in bounds
+                                 if (low is None or age >= low) and (high is None or age <= high)), None))
+        return points, winners
+
+    def find(self, gender, age):
+        """Категория для пола и возраста или None"""
+        if age is None:
+            return None
+        points, winners = self.buckets.get(gender, self.mixed)
+        return winners[bisect_right(points, age)]
+
+
+def categorize_athletes(athletes, categories, reference_date=None):
     """Распределение спортсменов по категориям"""
+    index = CategoryIndex(categories)
+    reference_date = reference_date or datetime.today()
     categorized = {}
-    
+
     for athlete in athletes:
-        assigned = False
-        for category in categories:
-            if matches_category(athlete, category):
-                if category.name not in categorized:
-                    categorized[category.name] = []
-                categorized[category.name].append(athlete)
-                athlete.category_id = category.id
-                assigned = True
-                break
-        
-        if not assigned:
-            if 'Без категории' not in categorized:
-                categorized['Без категории'] = []
-            categorized['Без категории'].append(athlete)
-    
+        age = calculate_age(athlete.birth_date, reference_date) if athlete.birth_date else None
+        category = index.find(athlete.gender, age)
+        if category is not None:
+            athlete.category_id = category.id
+            categorized.setdefault(category.name, []).append(athlete)
+        else:
+            categorized.setdefault(NO_CATEGORY, []).append(athlete)
+
     return categorized
 
+
+def assign_categories(competition):
+    """Распределение участников соревнования с сохранением в БД.
+
+    Возраст считается один раз на дату начала соревнования. Меняются только
+    строки, у которых изменились возраст или категория; жеребьевка категорий,
+    чей состав изменился, удаляется. commit за вызывающим кодом.
+    """
+    reference_date = competition.start_date or datetime.today()
+    index = CategoryIndex(Category.query.filter_by(competition_id=competition.id).all())
+
+    table = Participant.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.birth_date, table.c.gender, table.c.age, table.c.category_id,
+               table.c.is_active)
+        .where(table.c.competition_id == competition.id)).all()
+
+    changes, moved = [], set()
+    for participant_id, birth_date, gender, age, category_id, is_active in rows:
+        new_age = calculate_age(birth_date, reference_date) if birth_date else age
+        # Отключенные при повторной загрузке состава участники в категории не попадают
+        category = index.find(gender, new_age) if is_active is not False else None
+        new_category_id = category.id if category is not None else None
+        if (new_age, new_category_id) != (age, category_id):
+            changes.append({'pid': participant_id, 'new_age': new_age, 'new_category_id': new_category_id})
+            if new_category_id != category_id:
+                moved.update((category_id, new_category_id))
+
+    if changes:
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('pid'))
+            .values(age=bindparam('new_age'), category_id=bindparam('new_category_id')),
+            changes)
+    drop_draws(moved)
+    competition.categories_stale = False
+    return len(changes)
+
+
+def category_conditions(competition_id, min_age, max_age, gender):
+    """Условия отбора участников в категорию (те же правила, что у matches_category)"""
+    table = Participant.__table__
+    conditions = [table.c.competition_id == competition_id, table.c.age.isnot(None),
+                  table.c.is_active.isnot(False)]
+    if gender:
+        conditions.append(table.c.gender == gender)
+    if min_age:
+        conditions.append(table.c.age >= min_age)
+    if max_age:
+        conditions.append(table.c.age <= max_age)
+    return conditions
+
+
+def find_overlaps(competition_id, min_age, max_age, gender, exclude_id=None):
+    """Категории соревнования, пересекающиеся по полу и возрасту с заданными границами"""
+    low, high = min_age or float('-inf'), max_age or float('inf')
+    overlaps = []
+    for category in Category.query.filter_by(competition_id=competition_id).all():
+        if category.id == exclude_id:
+            continue
+        if gender and category.gender and gender != category.gender:
+            continue
+        if (category.min_age or float('-inf')) <= high and low <= (category.max_age or float('inf')):
+            overlaps.append(category)
+    return overlaps
+
+
+def preview_category(competition_id, min_age, max_age, gender):
+    """Сколько участников попадет в категорию (без изменения данных)"""
+    table = Participant.__table__
+    return db.session.execute(
+        select(func.count()).select_from(table)
+        .where(*category_conditions(competition_id, min_age, max_age, gender))).scalar()
+
+
+def reassign_category(category):
+    """Перераспределение участников категории двумя UPDATE без загрузки объектов.
+
+    Категории соревнования не пересекаются (это проверяется при сохранении),
+    поэтому подходящие по полу и возрасту участники однозначно принадлежат этой категории.
+    Жеребьевка удаляется у категории, если ее состав изменился, и у категорий, откуда
+    забраны спортсмены.
+    """
+    db.session.flush()
+    table = Participant.__table__
+    conditions = category_conditions(category.competition_id, category.min_age, category.max_age, category.gender)
+    members = set(db.session.execute(select(table.c.id).where(table.c.category_id == category.id)).scalars())
+    matching = db.session.execute(select(table.c.id, table.c.category_id).where(*conditions)).all()
+
+    released = db.session.execute(
+        update(table).where(table.c.category_id == category.id).values(category_id=None)).rowcount
+    assigned = db.session.execute(update(table).where(*conditions).values(category_id=category.id)).rowcount
+
+    moved = {category_id for _, category_id in matching if category_id != category.id}
+    if members != {participant_id for participant_id, _ in matching}:
+        moved.add(category.id)
+    drop_draws(moved)
+    return released, assigned
+
+
+def release_category(category):
+    """Снятие всех участников с категории вместе с ее жеребьевкой"""
+    table = Participant.__table__
+    drop_draws([category.id])
+    return db.session.execute(
+        update(table).where(table.c.category_id == category.id).values(category_id=None)).rowcount
+
+
+def drop_draws(category_ids):
+    """Удаление жеребьевки категорий, состав которых изменился (None - без категории - пропускается)"""
+    category_ids = [category_id for category_id in set(category_ids) if category_id is not None]
+    if category_ids:
+        table = Draw.__table__
+        db.session.execute(delete(table).where(table.c.category_id.in_(category_ids)))
+
+
 def matches_category(athlete, category):
     """Проверка соответствия спортсмена категории"""
     # Проверка пола
@@ -47,29 +205,118 @@ def matches_category(athlete, category):
     
     return True
 
-def calculate_age(birth_date):
-    """Расчет возраста"""
-    today = datetime.today()
+def calculate_age(birth_date, today=None):
+    """Расчет возраста (на сегодня или на дату today)"""
+    today = today or datetime.today()
     return today.year - birth_date.year - (
         (today.month, today.day) < (birth_date.month, birth_date.day)
     )
 
-def generate_draw(category_athletes):
-    """Генерация сетки соревнований"""
+def generate_draw(category_athletes, seed=None):
+    """Порядок выступления по категориям: {категория: {'seed': ..., 'order': [id участников]}}"""
+    seed = new_seed() if seed is None else str(seed)
     draw = {}
     
     for category_name, athletes in category_athletes.items():
-        # Случайный порядок выступления
-        random.shuffle(athletes)
-        
-        # Создание пар для первого раунда
-        orders = []
-        for i in range(0, len(athletes)):
-            orders.append([athletes[i]])
-   
-        draw = {
-            'category_name': category_name,
-            'orders': orders
+        rng = category_rng(seed, category_name)
+        draw[category_name] = {
+            'seed': seed,
+            'order': spread_clubs([(athlete.id, athlete.club) for athlete in athletes], rng)
         }
     
-    return draw
\ No newline at end of file
+    return draw
+
+
+def new_seed():
+    return f'{random.getrandbits(32):08x}'
+
+
+def category_rng(seed, category_key):
+    """Генератор категории зависит только от seed жеребьевки и самой категории,
+    поэтому перегенерация одной категории не меняет порядок в остальных"""
+    return random.Random(f'{seed}:{category_key}')
+
+
+def spread_clubs(athletes, rng):
+    """Случайный порядок выступления, в котором спортсмены одного клуба разнесены.
+
+    athletes - пары (id участника, клуб). На каждом шаге выступает клуб с наибольшим
+    остатком, кроме только что выступившего; равные клубы упорядочены случайно.
+    Два спортсмена одного клуба оказываются рядом, только если клуб занимает больше
+    половины категории. O(n log k), k - число клубов.
+    """
+    clubs = {}
+    for participant_id, club in athletes:
+        # Спортсмены без клуба ни с кем не разводятся
+        key = (club or '').strip().lower() or participant_id
+        clubs.setdefault(key, []).append(participant_id)
+    
+    heap = []
+    for members in clubs.values():
+        rng.shuffle(members)
+        heap.append((-len(members), rng.random(), members))
+    heapq.heapify(heap)
+    
+    order = []
+    held = None
+    while heap:
+        count, _, members = heapq.heappop(heap)
+        order.append(members.pop())
+        if held is not None:
+            heapq.heappush(heap, held)
+        held = (count + 1, rng.random(), members) if members else None
+    if held is not None:
+        # Остался один клуб - развести уже не с кем
+        order.extend(reversed(held[2]))
+    return order
+
+
+def draw_competition(competition_id, seed=None, category_id=None):
+    """Жеребьевка всех категорий соревнования (или одной category_id) с сохранением.
+
+    Возвращает (seed, {category_id: порядок}). commit за вызывающим кодом.
+    """
+    seed = new_seed() if seed in (None, '') else str(seed)
+    table = Participant.__table__
+    query = (select(table.c.id, table.c.club, table.c.category_id)
+             .where(table.c.competition_id == competition_id, table.c.category_id.isnot(None),
+                    table.c.is_active.isnot(False))
+             .order_by(table.c.id))
+    if category_id is not None:
+        query = query.where(table.c.category_id == category_id)
+    
+    by_category = {}
+    for participant_id, club, athlete_category_id in db.session.execute(query):
+        by_category.setdefault(athlete_category_id, []).append((participant_id, club))
+    
+    draws = {key: spread_clubs(athletes, category_rng(seed, key)) for key, athletes in by_category.items()}
+    
+    draw_table = Draw.__table__
+    if category_id is None:
+        # Жеребьевка опустевших категорий больше не действительна
+        db.session.execute(delete(draw_table).where(
+            draw_table.c.competition_id == competition_id, draw_table.c.category_id.notin_(list(draws))))
+    elif not draws:
+        db.session.execute(delete(draw_table).where(draw_table.c.category_id == category_id))
+    
+    if draws:
+        statement = sqlite_insert(draw_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['category_id'],
+            set_={field: statement.excluded[field] for field in ('seed', 'participant_ids', 'created_at')})
+        created_at = datetime.utcnow()
+        db.session.execute(statement, [
+            {'competition_id': competition_id, 'category_id': key, 'seed': seed,
+             'participant_ids': ','.join(map(str, order)), 'created_at': created_at}
+            for key, order in draws.items()])
+    return seed, draws
+
+
+def load_draws(competition_id):
+    """Сохраненная жеребьевка: {category_id: {'seed': ..., 'order': [id участников]}}"""
+    table = Draw.__table__
+    rows = db.session.execute(
+        select(table.c.category_id, table.c.seed, table.c.participant_ids)
+        .where(table.c.competition_id == competition_id))
+    return {category_id: {'seed': seed, 'order': [int(pid) for pid in participant_ids.split(',') if pid]}
+            for category_id, seed, participant_ids in rows}
@@ -1,33 +1,316 @@
+import hashlib
+import re
 import pandas as pd
+import xlsxwriter
 from datetime import datetime
+from openpyxl import load_workbook
+from sqlalchemy import bindparam, select, update
+from database import db
 from models import Participant
+from utils.metrics import metrics
 
-def import_participants_from_excel(file_path, id):
-    """Импорт спортсменов из Excel файла"""
+# Столбцы файла и соответствующие поля Participant
+COLUMNS = {
+    'Фамилия': 'last_name',
+    'Имя': 'first_name',
+    'Отчество': 'second_name',
+    'Дата рождения': 'birth_date',
+    'Пол': 'gender',
+    'Клуб': 'club',
+    'Номер': 'registration_number'
+}
+TEXT_COLUMNS = ['Фамилия', 'Имя', 'Отчество', 'Пол', 'Клуб', 'Номер']
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y']
+INSERT_CHUNK_SIZE = 1000
+# Поля, по которым строка файла сравнивается с уже загруженным участником
+SYNC_FIELDS = ['last_name', 'first_name', 'second_name', 'birth_date', 'gender', 'club']
+
+# Столбцы протокола: заголовок, поле результата, ширина
+EXPORT_COLUMNS = [
+    ('Место', 'place', 8),
+    ('Фамилия', 'last_name', 20),
+    ('Имя', 'first_name', 15),
+    ('Клуб', 'club', 25),
+    ('Раунд 1', 'round1', 10),
+    ('Раунд 2', 'round2', 10),
+    ('Раунд 3', 'round3', 10),
+    ('Общий балл', 'total', 12),
+    ('Средний балл', 'average', 12)
+]
+SHEET_NAME_LENGTH = 31
+INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+
+@metrics.timed('import_participants_from_excel')
+def import_participants_from_excel(file_path, id, reference_date=None):
+    """Импорт спортсменов из Excel файла.
+
+    Возвращает (rows, errors): словари для массовой вставки и список
+    (номер строки в файле, текст ошибки) для отклоненных строк.
+    """
     try:
-        df = pd.read_excel(file_path)
-        
-        participants = []
-        for _, row in df.iterrows():
-            participant = Participant(
-                last_name=str(row.get('Фамилия', '')),
-                first_name=str(row.get('Имя', '')),
-                second_name=str(row.get('Отчество', '')),
-                birth_date = parse_date(row.get('Дата рождения')),
-                gender=str(row.get('Пол', '')),
-                # weight=float(row.get('Вес', 0)) if pd.notna(row.get('Вес')) else None,
-                # height=float(row.get('Рост', 0)) if pd.notna(row.get('Рост')) else None,
-                club=str(row.get('Клуб', '')),
-                registration_number=str(row.get('Номер', '')),
-                competition_id = id
-            )
-            participant.set_age()
-            participants.append(participant)
-        
-        return participants
+        df = pd.read_excel(file_path,
+                           usecols=lambda column: column in COLUMNS,
+                           dtype={column: str for column in TEXT_COLUMNS})
     except Exception as e:
         raise Exception(f"Ошибка при чтении Excel файла: {str(e)}")
 
+    return prepare_participant_rows(df, id, reference_date)
+
+
+def stream_participants_from_excel(file_path, id, chunk_size=INSERT_CHUNK_SIZE, reference_date=None):
+    """Потоковое чтение .xlsx (openpyxl read_only): выдает (rows, errors) пачками по chunk_size строк.
+
+    Книга не загружается в память целиком, поэтому расход памяти не зависит от размера файла.
+    """
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        raise Exception(f"Ошибка при чтении Excel файла: {str(e)}")
+
+    reference_date = reference_date or datetime.now()
+    try:
+        lines = workbook.active.iter_rows(values_only=True)
+        header = next(lines, None)
+        if header is None:
+            return
+        positions = {name: position for position, name in enumerate(header) if name in COLUMNS}
+
+        records, index = [], []
+        for row_number, values in enumerate(lines, start=2):
+            if all(value is None for value in values):
+                continue
+            records.append({name: values[position] if position < len(values) else None
+                            for name, position in positions.items()})
+            index.append(row_number - 2)
+            if len(records) >= chunk_size:
+                yield prepare_participant_rows(pd.DataFrame(records, index=index), id, reference_date)
+                records, index = [], []
+        if records:
+            yield prepare_participant_rows(pd.DataFrame(records, index=index), id, reference_date)
+    finally:
+        workbook.close()
+
+
+def count_sheet_rows(file_path):
+    """Число строк данных по размерам листа .xlsx (без чтения содержимого); None, если неизвестно"""
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    return max_row - 1 if max_row else None
+
+
+def read_participant_chunks(file_path, id, chunk_size=INSERT_CHUNK_SIZE, reference_date=None, count=False):
+    """Пачки (rows, errors) файла: .xlsx читается потоково, .xls - через pandas.
+
+    Возвращает (пачки, всего строк или None); строки считаются только при count=True.
+    """
+    if file_path.lower().endswith('.xlsx'):
+        total = count_sheet_rows(file_path) if count else None
+        return stream_participants_from_excel(file_path, id, chunk_size, reference_date), total
+    return [import_participants_from_excel(file_path, id, reference_date)], None
+
+
+@metrics.timed('import_and_insert_participants')
+def import_and_insert_participants(file_path, id, chunk_size=INSERT_CHUNK_SIZE, reference_date=None,
+                                   on_progress=None):
+    """Импорт с массовой вставкой; .xlsx читается потоково, .xls - через pandas.
+
+    on_progress(обработано строк, всего строк или None) вызывается после каждой пачки.
+    Возвращает (число вставленных строк, ошибки). Commit остается за вызывающим кодом.
+    """
+    chunks, total = read_participant_chunks(file_path, id, chunk_size, reference_date, count=bool(on_progress))
+
+    inserted, errors = 0, []
+    for rows, chunk_errors in chunks:
+        inserted += bulk_insert_participants(rows, chunk_size)
+        errors.extend(chunk_errors)
+        if on_progress:
+            on_progress(inserted + len(errors), total)
+    return inserted, errors
+
+
+@metrics.timed('sync_participants')
+def sync_participants(file_path, id, chunk_size=INSERT_CHUNK_SIZE, reference_date=None, on_progress=None,
+                      deactivate_missing=False):
+    """Повторная загрузка состава: применяются только отличия файла от уже загруженных участников.
+
+    Участник ищется по номеру, а без номера - по ФИО и дате рождения. Уже загруженные
+    участники соревнования читаются одним запросом, строки файла сравниваются с ними по хешу
+    полей SYNC_FIELDS: новые вставляются, измененные (и отключенные ранее) обновляются,
+    совпадающие не трогаются. При deactivate_missing отсутствующие в файле участники
+    отключаются (is_active). Повторная загрузка того же файла ничего не меняет.
+
+    Возвращает отчет {inserted, updated, deactivated, unchanged, errors, changes};
+    changes - список (действие, участник). Commit остается за вызывающим кодом.
+    """
+    table = Participant.__table__
+    existing = {}
+    for row in db.session.execute(
+            select(table.c.id, table.c.registration_number, table.c.is_active,
+                   *(table.c[field] for field in SYNC_FIELDS))
+            .where(table.c.competition_id == id)).mappings():
+        existing[participant_key(row)] = (row['id'], row_hash(row), row['is_active'] is not False,
+                                          participant_label(row))
+
+    report = {'inserted': 0, 'updated': 0, 'deactivated': 0, 'unchanged': 0, 'errors': [], 'changes': []}
+    chunks, total = read_participant_chunks(file_path, id, chunk_size, reference_date, count=bool(on_progress))
+    seen, processed = set(), 0
+    for rows, chunk_errors in chunks:
+        report['errors'].extend(chunk_errors)
+        processed += len(rows) + len(chunk_errors)
+
+        inserts, updates = [], []
+        for row in rows:
+            key = participant_key(row)
+            if key in seen:
+                report['errors'].append((None, f'{participant_label(row)} повторяется в файле'))
+                continue
+            seen.add(key)
+            if key not in existing:
+                inserts.append(row)
+                continue
+            participant_id, current_hash, active, _ = existing[key]
+            if active and current_hash == row_hash(row):
+                report['unchanged'] += 1
+                continue
+            updates.append(dict({field: row[field] for field in SYNC_FIELDS},
+                                pid=participant_id, new_age=row['age']))
+            report['changes'].append(('обновлен' if active else 'снова включен', participant_label(row)))
+
+        inserts = reject_taken_numbers(inserts, report['errors'])
+        bulk_insert_participants(inserts, chunk_size)
+        report['changes'].extend(('добавлен', participant_label(row)) for row in inserts)
+        if updates:
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('pid'))
+                .values(age=bindparam('new_age'), is_active=True,
+                        **{field: bindparam(field) for field in SYNC_FIELDS}),
+                updates)
+        report['inserted'] += len(inserts)
+        report['updated'] += len(updates)
+        if on_progress:
+            on_progress(processed, total)
+
+    if deactivate_missing:
+        missing = [(participant_id, label) for key, (participant_id, _, active, label) in existing.items()
+                   if active and key not in seen]
+        for start in range(0, len(missing), chunk_size):
+            ids = [participant_id for participant_id, _ in missing[start:start + chunk_size]]
+            db.session.execute(update(table).where(table.c.id.in_(ids)).values(is_active=False))
+        report['deactivated'] = len(missing)
+        report['changes'].extend(('отключен', label) for _, label in missing)
+
+    report['errors'].sort(key=lambda error: (error[0] is None, error[0] or 0))
+    return report
+
+
+def participant_key(row):
+    """Ключ сопоставления: номер, а без номера - ФИО и дата рождения"""
+    if row['registration_number']:
+        return ('number', row['registration_number'])
+    return ('name', *((row[field] or '').lower() for field in ('last_name', 'first_name', 'second_name')),
+            row['birth_date'])
+
+
+def row_hash(row):
+    """Хеш сравниваемых полей; пустые значения и None не различаются"""
+    values = [row[field].isoformat() if field == 'birth_date' and row[field] else row[field] or ''
+              for field in SYNC_FIELDS]
+    return hashlib.sha1('\x1f'.join(values).encode('utf-8')).hexdigest()
+
+
+def participant_label(row):
+    name = f"{row['last_name']} {row['first_name']}"
+    return f"{name} ({row['registration_number']})" if row['registration_number'] else name
+
+
+def reject_taken_numbers(rows, errors):
+    """Номера уникальны во всей базе: строки с номером, занятым в другом соревновании, уходят в ошибки"""
+    numbers = [row['registration_number'] for row in rows if row['registration_number']]
+    if not numbers:
+        return rows
+    table = Participant.__table__
+    taken = set()
+    for start in range(0, len(numbers), INSERT_CHUNK_SIZE):
+        taken.update(db.session.execute(
+            select(table.c.registration_number)
+            .where(table.c.registration_number.in_(numbers[start:start + INSERT_CHUNK_SIZE]))).scalars())
+    if not taken:
+        return rows
+    errors.extend((None, f'{participant_label(row)}: номер занят в другом соревновании')
+                  for row in rows if row['registration_number'] in taken)
+    return [row for row in rows if row['registration_number'] not in taken]
+
+
+def prepare_participant_rows(df, competition_id, reference_date=None):
+    """Построчная проверка и подготовка данных по столбцам, без обхода iterrows"""
+    df = df.reindex(columns=list(COLUMNS))
+    for column in TEXT_COLUMNS:
+        df[column] = df[column].fillna('').astype(str).str.strip()
+    df['Пол'] = df['Пол'].str.lower()
+
+    raw_dates = df['Дата рождения']
+    birth_dates = parse_dates(raw_dates)
+    ages = calculate_ages(birth_dates, reference_date or datetime.now())
+
+    # Excel нумерует строки с 1, первая строка - заголовок
+    row_numbers = df.index + 2
+    errors = []
+    invalid = pd.Series(False, index=df.index)
+    checks = [
+        (df['Фамилия'] == '', 'не указана фамилия'),
+        (df['Имя'] == '', 'не указано имя'),
+        (birth_dates.isna() & raw_dates.notna(), 'некорректная дата рождения'),
+    ]
+    for mask, message in checks:
+        errors.extend((int(number), message) for number in row_numbers[mask])
+        invalid |= mask
+    errors.sort()
+
+    valid = df[~invalid]
+    rows = pd.DataFrame({
+        'last_name': valid['Фамилия'],
+        'first_name': valid['Имя'],
+        'second_name': valid['Отчество'],
+        'birth_date': birth_dates[~invalid].dt.date.astype(object).where(birth_dates[~invalid].notna(), None),
+        'age': ages[~invalid].astype(object).where(ages[~invalid].notna(), None),
+        'gender': valid['Пол'],
+        'club': valid['Клуб'],
+        'registration_number': valid['Номер'].replace('', None),
+        'competition_id': competition_id
+    }).to_dict('records')
+    return rows, errors
+
+
+def parse_dates(values):
+    """Разбор столбца дат: даты Excel и строки в форматах DATE_FORMATS"""
+    parsed = pd.to_datetime(values, format=DATE_FORMATS[0], errors='coerce')
+    for date_format in DATE_FORMATS[1:]:
+        missing = parsed.isna() & values.notna()
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(values[missing].astype(str), format=date_format, errors='coerce')
+    return parsed
+
+
+def calculate_ages(birth_dates, reference_date):
+    """Полных лет на дату reference_date для всего столбца сразу"""
+    ages = reference_date.year - birth_dates.dt.year
+    before_birthday = (birth_dates.dt.month > reference_date.month) | (
+        (birth_dates.dt.month == reference_date.month) & (birth_dates.dt.day > reference_date.day))
+    return (ages - before_birthday.astype(int)).astype('Int64')
+
+
+def bulk_insert_participants(rows, chunk_size=INSERT_CHUNK_SIZE):
+    """Массовая вставка спортсменов пачками через executemany"""
+    table = Participant.__table__
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(table.insert(), rows[start:start + chunk_size])
+    return len(rows)
+
 def parse_date(date_str):
     """Парсинг даты из различных форматов"""
     if pd.isna(date_str):
@@ -41,41 +324,50 @@ def parse_date(date_str):
     except:
         return None
 
-def export_results_to_excel(results, output_path):
-    """Экспорт результатов в Excel"""
-    data = []
+@metrics.timed('export_results_to_excel')
+def export_results_to_excel(results, output):
+    """Экспорт результатов в Excel: лист на категорию, строки пишутся по мере чтения results.
+
+    output - путь или файловый объект. В режиме constant_memory XlsxWriter держит
+    в памяти только текущую строку листа, поэтому память не растет с числом спортсменов.
+    Строки категории должны идти в порядке мест, листы создаются в порядке появления категорий.
+    """
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_format = workbook.add_format({
+        'bold': True,
+        'text_wrap': True,
+        'valign': 'top',
+        'bg_color': '#D7E4BC',
+        'border': 1
+    })
+
+    sheets = {}
     for result in results:
-        data.append({
-            'Место': result['place'],
-            'Фамилия': result['last_name'],
-            'Имя': result['first_name'],
-            'Клуб': result['club'],
-            'Категория': result['category'],
-            'Раунд 1': result['round1'],
-            'Раунд 2': result['round2'],
-            'Раунд 3': result['round3'],
-            'Общий балл': result['total'],
-            'Средний балл': result['average']
-        })
-    
-    df = pd.DataFrame(data)
-    with pd.ExcelWriter(output_path, engine='xlsxwriter') as writer:
-        df.to_excel(writer, sheet_name='Результаты', index=False)
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Результаты']
-        
-        # Форматирование
-        header_format = workbook.add_format({
-            'bold': True,
-            'text_wrap': True,
-            'valign': 'top',
-            'bg_color': '#D7E4BC',
-            'border': 1
-        })
-        
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-            worksheet.set_column(col_num, col_num, 15)
-    
-    return output_path
\ No newline at end of file
+        sheet = sheets.get(result['category'])
+        if sheet is None:
+            sheet = sheets[result['category']] = [add_results_sheet(workbook, result['category'], header_format), 1]
+        worksheet, row = sheet
+        worksheet.write_row(row, 0, [result[field] for _, field, _ in EXPORT_COLUMNS])
+        sheet[1] += 1
+
+    if not sheets:
+        add_results_sheet(workbook, 'Результаты', header_format)
+    workbook.close()
+    return output
+
+
+def add_results_sheet(workbook, category, header_format):
+    """Лист категории с заголовком; имя приводится к ограничениям Excel"""
+    name = INVALID_SHEET_CHARS.sub(' ', category).strip()[:SHEET_NAME_LENGTH] or 'Категория'
+    taken = {sheet.name.lower() for sheet in workbook.worksheets()}
+    base, number = name, 1
+    while name.lower() in taken:
+        number += 1
+        suffix = f' ({number})'
+        name = base[:SHEET_NAME_LENGTH - len(suffix)] + suffix
+
+    worksheet = workbook.add_worksheet(name)
+    for column, (title, _, width) in enumerate(EXPORT_COLUMNS):
+        worksheet.set_column(column, column, width)
+        worksheet.write(0, column, title, header_format)
+    return worksheet
\ No newline at end of file
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from database import db
+from models import Competition
+from utils.data_versions import data_versions
+
+TMP_PREFIX = 'tmp-'
+
+
+def data_stamp(competition_id):
+    """Отпечаток данных соревнования, от которых зависят протоколы.
+
+    Версия data_versions растет при каждой записи в соревновании (оценки, состав
+    и его поля, категории, жеребьевка), поэтому любое изменение того, что выводится
+    в протоколе, меняет отпечаток; к ней добавляются поля соревнования из шапки.
+    """
+    competition = db.session.get(Competition, competition_id)
+    header = (competition.name, competition.start_date, competition.end_date, competition.location) \
+        if competition else None
+    version = data_versions.current(competition_id)
+    return hashlib.sha1(repr((version, header)).encode()).hexdigest()[:16]
+
+
+class ExportCache:
+    """Дисковый кэш сгенерированных протоколов.
+
+    Имя файла содержит ключ (тип, соревнование, отпечаток данных), поэтому
+    повторные скачивания неизменившегося протокола отдаются готовым файлом.
+    При превышении EXPORT_CACHE_MAX_BYTES удаляются давно не запрашивавшиеся файлы.
+    Каталог общий для процессов сервера: файл появляется атомарной заменой,
+    блокировки по ключу лишь не дают собирать один протокол дважды в одном процессе.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = None
+        self._locks = defaultdict(threading.Lock)
+        self._evict_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], 'export_cache'))
+        self.max_bytes = app.config['EXPORT_CACHE_MAX_BYTES']
+
+    def key(self, kind, competition_id):
+        return f'{kind}-{competition_id}-{data_stamp(competition_id)}'
+
+    def get_or_build(self, key, extension, build):
+        """Путь к файлу протокола; build(path) вызывается только при промахе"""
+        path = os.path.join(self.directory, f'{key}.{extension}')
+        with self._locks[key]:
+            try:
+                os.utime(path)  # отметка для LRU
+                return path
+            except FileNotFoundError:
+                # Нет в кэше или файл только что вытеснен другим процессом сервера
+                pass
+
+            os.makedirs(self.directory, exist_ok=True)
+            # Сборка во временный файл и атомарная замена: параллельные запросы не видят недописанный файл
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=TMP_PREFIX, suffix=f'.{extension}')
+            os.close(fd)
+            try:
+                build(tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        self._locks.pop(key, None)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Удаление самых старых файлов, пока кэш не уложится в лимит"""
+        with self._evict_lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.startswith(TMP_PREFIX):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, path in sorted(entries):
+                if size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+
+
+export_cache = ExportCache()
@@ -0,0 +1,208 @@
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, select, update
+from loguru import logger
+from database import db
+from models import Job
+
+
+class JobQueue:
+    """Очередь фоновых задач.
+
+    Задачи хранятся в таблице jobs (переживают перезапуск процесса) и выполняются
+    локальным пулом потоков, без внешнего брокера. Несколько процессов сервера
+    работают с одной таблицей: задачу забирает тот, чей UPDATE первым сменил статус
+    queued -> running, там же проверяется лимит одновременных задач типа из JOB_LIMITS.
+    Выполняющий процесс раз в JOB_HEARTBEAT_SECONDS отмечается в строке задачи
+    (вместе с прогрессом для других процессов); задачи без отметки дольше
+    JOB_STALE_SECONDS считаются брошенными и ставятся в очередь заново.
+    Задача, упершаяся в лимит, не ждет в потоке пула: она откладывается и снова
+    отправляется в пул, когда задача того же типа завершится, или фоновой проверкой.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.handlers = {}
+        self.limits = {}
+        self.progress = {}
+        self.worker = None
+        self.heartbeat_interval = 2
+        self.stale_after = 60
+        self._deferred = {}
+        self._watcher = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        # Имя процесса - здесь, а не при импорте: модуль может быть импортирован
+        # процессом-родителем gunicorn до fork, и все процессы получили бы его pid
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        self.executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='job')
+        self.limits = dict(app.config['JOB_LIMITS'])
+        self.heartbeat_interval = app.config['JOB_HEARTBEAT_SECONDS']
+        self.stale_after = app.config['JOB_STALE_SECONDS']
+
+    def handler(self, kind):
+        """Регистрация обработчика: func(job, **params) -> JSON-совместимый результат"""
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def submit(self, kind, **params):
+        """Постановка задачи в очередь"""
+        job = Job(kind=kind, params=json.dumps(params))
+        db.session.add(job)
+        db.session.commit()
+        self.executor.submit(self._run, job.id)
+        return job
+
+    def resume_pending(self):
+        """Запуск задач из очереди и брошенных остановившимися процессами; далее - фоновая проверка.
+
+        Задачи, которые выполняют другие живые процессы, не трогаются.
+        """
+        self.requeue_stale()
+        for (job_id,) in db.session.query(Job.id).filter_by(status='queued').all():
+            self.executor.submit(self._run, job_id)
+        self._start_watcher()
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, name='job-heartbeat', daemon=True)
+                self._watcher.start()
+
+    def requeue_stale(self):
+        """Задачи running без отметки дольше stale_after - обратно в очередь; возвращает их id"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        stale = (Job.status == 'running') & ((Job.heartbeat_at < cutoff) | Job.heartbeat_at.is_(None))
+        job_ids = [job_id for job_id, in db.session.query(Job.id).filter(stale)]
+        if job_ids:
+            db.session.execute(update(Job).where(Job.id.in_(job_ids), stale).values(status='queued', worker=None)
+                               .execution_options(synchronize_session=False))
+            logger.warning(f"Задачи остановившихся процессов снова в очереди: {', '.join(map(str, job_ids))}")
+        db.session.commit()
+        return job_ids
+
+    def report(self, job_id, percent, message=None):
+        """Прогресс хранится в памяти: запись в БД на каждый шаг блокировала бы SQLite"""
+        with self._lock:
+            self.progress[job_id] = (percent, message)
+
+    def status(self, job):
+        # Задачу может выполнять другой процесс - тогда прогресс из его последней отметки
+        with self._lock:
+            percent, message = self.progress.get(
+                job.id, (100 if job.status == 'done' else job.progress or 0, job.message))
+        return {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': percent,
+            'message': message,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error
+        }
+
+    def claim(self, job_id, kind):
+        """Атомарный захват задачи этим процессом с учетом лимита типа во всех процессах.
+
+        Возвращает True (задача наша), False (ее забрал другой процесс) или None (лимит занят).
+        """
+        now = datetime.utcnow()
+        conditions = [Job.id == job_id, Job.status == 'queued']
+        limit = self.limits.get(kind)
+        if limit:
+            running = select(func.count()).select_from(Job).where(Job.kind == kind, Job.status == 'running')
+            conditions.append(running.scalar_subquery() < limit)
+        claimed = db.session.execute(update(Job).where(*conditions).values(
+            status='running', worker=self.worker, started_at=now, heartbeat_at=now)
+            .execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if claimed:
+            return True
+        return None if db.session.get(Job, job_id).status == 'queued' else False
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            if job is None or job.status != 'queued':
+                return
+
+            kind = job.kind
+            claimed = self.claim(job_id, kind)
+            if claimed is None:
+                self._defer(job_id, kind)
+                return
+            if not claimed:
+                return
+            with self._lock:
+                self.progress[job_id] = (0, None)
+
+            job = db.session.get(Job, job_id)
+            try:
+                result = self.handlers[job.kind](job, **json.loads(job.params or '{}'))
+                job.result = json.dumps(result, default=str)
+                job.status = 'done'
+            except Exception as e:
+                logger.exception(f'Задача {job_id} ({job.kind}) завершилась ошибкой')
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+                with self._lock:
+                    self.progress.pop(job_id, None)
+                self._resubmit_deferred(kind)
+
+    def _defer(self, job_id, kind):
+        """Задача ждет освобождения лимита вне пула, строка остается queued"""
+        with self._lock:
+            self._deferred[job_id] = kind
+        self._start_watcher()
+
+    def _resubmit_deferred(self, kind=None):
+        """Отложенные задачи типа kind (или все) снова в пул; лишние опять отложатся в claim"""
+        with self._lock:
+            job_ids = [job_id for job_id, job_kind in self._deferred.items() if kind in (None, job_kind)]
+            for job_id in job_ids:
+                del self._deferred[job_id]
+        for job_id in job_ids:
+            self.executor.submit(self._run, job_id)
+
+    def _watch(self):
+        """Отметки жизни задач этого процесса с прогрессом, возврат в очередь брошенных задач
+        и повтор отложенных (лимит мог освободиться в другом процессе)"""
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                self._resubmit_deferred()
+                with self.app.app_context():
+                    with self._lock:
+                        beats = [{'job_id': job_id, 'percent': percent, 'text': message}
+                                 for job_id, (percent, message) in self.progress.items()]
+                    if beats:
+                        db.session.execute(
+                            update(Job.__table__)
+                            .where(Job.__table__.c.id == bindparam('job_id'),
+                                   Job.__table__.c.worker == self.worker)
+                            .values(heartbeat_at=datetime.utcnow(), progress=bindparam('percent'),
+                                    message=bindparam('text')),
+                            beats)
+                        db.session.commit()
+                    for job_id in self.requeue_stale():
+                        self.executor.submit(self._run, job_id)
+            except Exception:
+                logger.exception('Ошибка фоновой проверки задач')
+
+
+job_queue = JobQueue()
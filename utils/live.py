@@ -0,0 +1,216 @@
+import json
+import queue
+import threading
+import time
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from loguru import logger
+from database import db
+from models import Participant, Standing
+from utils.data_versions import data_versions, REBUILD_SCOPE
+from utils.pages import participant_row
+
+PENDING_KEY = 'live_changes'
+RESET = 'reset'
+ALL_CATEGORIES = 'all'
+
+
+class LiveResults:
+    """Рассылка изменений турнирной таблицы подписчикам (Server-Sent Events).
+
+    Каждый подписчик - очередь в памяти процесса. record_score отмечает в сессии
+    изменившиеся строки, после commit они одним запросом читаются и раскладываются
+    по очередям подписчиков соревнования. Ожидающий подписчик не выполняет запросов
+    к БД, поэтому открытые табло почти не нагружают сервер.
+
+    Изменения, записанные другими процессами сервера, видны только по версии
+    данных соревнования (data_versions): фоновый поток раз в LIVE_POLL_SECONDS
+    сверяет версии соревнований с подписчиками и при чужом изменении рассылает
+    строки таблицы, записанные после известной версии (Standing.version). Команду
+    перечитать таблицу клиенты получают только после ее перестроения (mark_reset).
+
+    Ожидающий подписчик все же занимает поток сервера, поэтому их число в процессе
+    ограничено LIVE_MAX_STREAMS: сверх лимита subscribe возвращает None.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.heartbeat = 15
+        self.queue_size = 100
+        self.poll_interval = 1
+        self.max_streams = 0
+        self._subscribers = {}
+        self._versions = {}
+        self._poller = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.heartbeat = app.config['LIVE_HEARTBEAT_SECONDS']
+        self.queue_size = app.config['LIVE_QUEUE_SIZE']
+        self.poll_interval = app.config['LIVE_POLL_SECONDS']
+        self.max_streams = app.config['LIVE_MAX_STREAMS']
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_soft_rollback', self._after_rollback)
+        data_versions.on_commit(self._after_versions)
+
+    def mark_changed(self, competition_id, participant_ids):
+        """Строки таблицы изменены в текущей транзакции (рассылка после commit)"""
+        pending = db.session.info.setdefault(PENDING_KEY, {})
+        if pending.get(competition_id) != RESET:
+            pending.setdefault(competition_id, set()).update(participant_ids)
+
+    def mark_reset(self, competition_id):
+        """Таблица соревнования перестраивается целиком - клиентам проще перечитать ее.
+
+        Перестроение отмечается и в data_versions для подписчиков других процессов;
+        возвращает версию данных соревнования текущей транзакции.
+        """
+        db.session.info.setdefault(PENDING_KEY, {})[competition_id] = RESET
+        return data_versions.mark_rebuild(competition_id)
+
+    def subscribe(self, competition_id):
+        """Новая очередь подписчика или None, если процесс уже держит max_streams потоков"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self.max_streams and sum(map(len, self._subscribers.values())) >= self.max_streams:
+                return None
+            self._subscribers.setdefault(competition_id, set()).add(subscriber)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='live-poller', daemon=True)
+                self._poller.start()
+        return subscriber
+
+    def unsubscribe(self, competition_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(competition_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(competition_id, None)
+                self._versions.pop(competition_id, None)
+
+    def subscriber_count(self, competition_id=None):
+        with self._lock:
+            if competition_id is not None:
+                return len(self._subscribers.get(competition_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, competition_id, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(competition_id, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Клиент не успевает читать: вместо накопленных изменений - одна команда перечитать
+                while not subscriber.empty():
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        break
+                subscriber.put_nowait(RESET)
+
+    def stream(self, subscriber, category_id=ALL_CATEGORIES):
+        """Генератор SSE для очереди из subscribe: изменившиеся строки категории (None - без категории)
+        или всего соревнования; отписка - за вызывающим кодом при закрытии ответа"""
+        yield 'retry: 3000\n\n'
+        while True:
+            try:
+                message = subscriber.get(timeout=self.heartbeat)
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+
+            if message == RESET:
+                yield 'event: reset\ndata: {}\n\n'
+                continue
+            rows = [row for row in message if category_id == ALL_CATEGORIES or row['category_id'] == category_id]
+            if rows:
+                yield f'event: standings\ndata: {json.dumps(rows, ensure_ascii=False)}\n\n'
+
+    def _after_commit(self, session):
+        pending = session.info.pop(PENDING_KEY, None)
+        if not pending:
+            return
+        pending = {competition_id: changes for competition_id, changes in pending.items()
+                   if self.subscriber_count(competition_id)}
+        if not pending:
+            return
+
+        changed = {pid for changes in pending.values() if changes != RESET for pid in changes}
+        rows = {}
+        if changed:
+            # Сессия после commit не выполняет запросов - читаем отдельной сессией
+            with Session(db.engine) as reader:
+                rows = self._rows(reader, Participant.id.in_(changed))
+
+        for competition_id, changes in pending.items():
+            if changes == RESET:
+                self.publish(competition_id, RESET)
+            else:
+                self.publish(competition_id, [rows[pid] for pid in changes if pid in rows])
+
+    @staticmethod
+    def _rows(reader, condition):
+        """{участник: строка таблицы для клиента} по условию на Participant/Standing"""
+        rows = {}
+        for participant, standing in reader.execute(
+                select(Participant, Standing)
+                .join(Standing, Standing.participant_id == Participant.id)
+                .where(condition)):
+            row = participant_row(participant, standing)
+            row['category_id'] = standing.category_id
+            rows[participant.id] = row
+        return rows
+
+    def _after_versions(self, versions):
+        """Собственный commit: версия, следующая за известной, уже разослана построчно"""
+        with self._lock:
+            for competition_id, version in versions.items():
+                if self._versions.get(competition_id) == version - 1:
+                    self._versions[competition_id] = version
+
+    def _poll(self):
+        """Сверка версий соревнований с подписчиками; по выросшей не нашим commit версии
+        рассылаются строки, записанные после известной версии, после перестроения - команда перечитать"""
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                competition_ids = list(self._subscribers)
+            if not competition_ids:
+                continue
+            try:
+                with self.app.app_context(), Session(db.engine) as reader:
+                    self._poll_once(reader, competition_ids)
+            except Exception:
+                logger.exception('Не удалось прочитать изменения для потоков результатов')
+
+    def _poll_once(self, reader, competition_ids):
+        versions = data_versions.current_many(competition_ids, reader)
+        changed = {}
+        with self._lock:
+            for competition_id, version in versions.items():
+                known = self._versions.get(competition_id)
+                if known is None or version > known:
+                    self._versions[competition_id] = version
+                    if known is not None:
+                        changed[competition_id] = known
+        if not changed:
+            return
+
+        rebuilt = data_versions.current_many(changed, reader, REBUILD_SCOPE)
+        for competition_id, known in changed.items():
+            if rebuilt[competition_id] > known:
+                self.publish(competition_id, RESET)
+                continue
+            # Версия прочитана раньше строк: строки, записанные позже, придут еще раз при следующей сверке
+            rows = self._rows(reader, (Standing.competition_id == competition_id) & (Standing.version > known))
+            if rows:
+                self.publish(competition_id, list(rows.values()))
+
+    def _after_rollback(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop(PENDING_KEY, None)
+
+
+live_results = LiveResults()
@@ -0,0 +1,222 @@
+import heapq
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, func, select
+from database import db
+from models import Category, MatSlot, Participant, Score
+from utils.results import ROUNDS
+
+DONE, RUNNING, PLANNED = 'done', 'running', 'planned'
+
+
+def category_workload(competition_id):
+    """Объем работы категорий соревнования тремя GROUP BY.
+
+    {category_id: {name, gender, min_age, max_age, athletes, performances (всего выступлений),
+    performed (уже оценено), first_batch (оценено в момент started_at), started_at, last_at}};
+    времена - scored_at первой и последней оценки (у старых строк - created_at).
+    Категории без участников не планируются.
+    """
+    participants, categories, scores = Participant.__table__, Category.__table__, Score.__table__
+    active = (participants.c.competition_id == competition_id, participants.c.is_active.isnot(False))
+    scored = (*active, participants.c.category_id.isnot(None), scores.c.total.isnot(None))
+    scored_at = func.coalesce(scores.c.scored_at, scores.c.created_at)
+    counts = dict(db.session.execute(
+        select(participants.c.category_id, func.count())
+        .where(*active, participants.c.category_id.isnot(None))
+        .group_by(participants.c.category_id)).all())
+    started = (select(participants.c.category_id, func.min(scored_at).label('started_at'))
+               .join(participants, participants.c.id == scores.c.participant_id)
+               .where(*scored)
+               .group_by(participants.c.category_id).subquery())
+    progress = {row[0]: row[1:] for row in db.session.execute(
+        select(participants.c.category_id, func.count(scores.c.id), func.min(scored_at), func.max(scored_at))
+        .join(participants, participants.c.id == scores.c.participant_id)
+        .where(*scored)
+        .group_by(participants.c.category_id))}
+    # Оценки первого пакета (одной записи /enter_scores/batch) - они не дают интервалов темпа
+    first_batch = dict(db.session.execute(
+        select(participants.c.category_id, func.count(scores.c.id))
+        .join(participants, participants.c.id == scores.c.participant_id)
+        .join(started, and_(started.c.category_id == participants.c.category_id,
+                            started.c.started_at == scored_at))
+        .where(*scored)
+        .group_by(participants.c.category_id)).all())
+
+    workload = {}
+    for category_id, name, gender, min_age, max_age in db.session.execute(
+            select(categories.c.id, categories.c.name, categories.c.gender, categories.c.min_age, categories.c.max_age)
+            .where(categories.c.competition_id == competition_id)):
+        if not counts.get(category_id):
+            continue
+        performed, started_at, last_at = progress.get(category_id, (0, None, None))
+        workload[category_id] = {
+            'name': name, 'gender': gender, 'min_age': min_age, 'max_age': max_age,
+            'athletes': counts[category_id],
+            'performances': counts[category_id] * len(ROUNDS),
+            'performed': performed, 'first_batch': first_batch.get(category_id, 0),
+            'started_at': started_at, 'last_at': last_at
+        }
+    return workload
+
+
+def pace_sample(category, min_samples):
+    """(секунд, выступлений) после первой оценки категории или None, если данных мало.
+
+    Выступления первого пакета оценок прошли до started_at и в интервал не входят;
+    без разброса времени (все оценки одним пакетом) замера нет.
+    """
+    if category['performed'] < min_samples:
+        return None
+    elapsed = (category['last_at'] - category['started_at']).total_seconds()
+    performed = category['performed'] - category['first_batch']
+    return (elapsed, performed) if elapsed > 0 and performed > 0 else None
+
+
+def observed_pace(workload, default, min_samples):
+    """Секунд на выступление: общий темп по категориям с достаточным числом оценок, иначе default"""
+    samples = [sample for sample in (pace_sample(category, min_samples) for category in workload.values()) if sample]
+    return sum(elapsed for elapsed, _ in samples) / sum(performed for _, performed in samples) if samples else default
+
+
+def category_pace(category, pace, min_samples):
+    """Темп категории по ее оценкам (после min_samples выступлений), иначе общий"""
+    sample = pace_sample(category, min_samples)
+    return sample[0] / sample[1] if sample else pace
+
+
+def category_status(category):
+    if category['performed'] >= category['performances']:
+        return DONE
+    return RUNNING if category['performed'] else PLANNED
+
+
+def age_key(category):
+    """Порядок возрастных групп: младшие выступают раньше"""
+    return (category['min_age'] or 0, category['max_age'] or float('inf'))
+
+
+def build_plan(workload, slots, mats, now, pace, changeover, min_samples=5, reassign=False, age_order=True):
+    """Расписание категорий по коврам.
+
+    Оконченные и начатые категории остаются на своих коврах (slots: {category_id: (ковер, позиция)}),
+    время окончания начатых прогнозируется по их темпу. Не начатые категории без места
+    (или все не начатые при reassign) раскладываются жадно: по возрастным группам от младших
+    (при age_order), внутри группы - от самых долгих, каждая на ковер, освобождающийся
+    раньше остальных (LPT). Так старшие группы не начинают раньше младших, а общее время
+    окончания близко к минимальному.
+
+    Не начатые категории ставятся только на первые mats ковров (с сохраненных ковров вне mats -
+    раскладываются заново); оконченные и начатые остаются и на коврах с большими номерами.
+
+    Возвращает {ковер: [слоты по порядку]}, слот - dict с category_id, status, start, end.
+    """
+    statuses = {category_id: category_status(category) for category_id, category in workload.items()}
+    lanes = {mat: [] for mat in range(max([mats] + [slots[category_id][0] + 1 for category_id, status in statuses.items()
+                                                    if status != PLANNED and category_id in slots]))}
+    pending = []
+    for category_id, category in workload.items():
+        status = statuses[category_id]
+        speed = category_pace(category, pace, min_samples)
+        remaining = (category['performances'] - category['performed']) * speed
+        slot = {'category_id': category_id, 'status': status,
+                'duration': remaining if status != PLANNED else remaining + changeover}
+        if status == DONE:
+            slot.update(start=category['started_at'], end=category['last_at'],
+                        duration=(category['last_at'] - category['started_at']).total_seconds())
+        elif status == RUNNING:
+            slot.update(start=category['started_at'], end=max(now, category['last_at'] + timedelta(seconds=speed))
+                        + timedelta(seconds=remaining - speed))
+        elif category_id in slots and not reassign and slots[category_id][0] < mats:
+            slot['position'] = slots[category_id][1]
+        else:
+            pending.append(slot)
+            continue
+
+        if category_id in slots:
+            lanes[slots[category_id][0]].append(slot)
+        else:
+            # Категорию начали без плана - на ковер, который освобождается раньше
+            lanes[min(range(mats), key=lambda mat: (lane_end(lanes[mat], now), mat))].append(slot)
+
+    # Сначала оконченные и начатые по времени начала, затем запланированные в прежнем порядке
+    heap = []
+    for mat, lane in lanes.items():
+        lane.sort(key=lambda slot: (slot['status'] == PLANNED, slot.get('start') or now, slot.get('position', 0)))
+        free = now
+        for slot in lane:
+            if slot['status'] == PLANNED:
+                slot['start'] = max(free, now)
+                slot['end'] = slot['start'] + timedelta(seconds=slot['duration'])
+            free = max(free, slot['end'])
+        if mat < mats:
+            heapq.heappush(heap, (free, mat))
+
+    pending.sort(key=lambda slot: ((age_key(workload[slot['category_id']]) if age_order else (0, 0)),
+                                   -slot['duration'], slot['category_id']))
+    for slot in pending:
+        free, mat = heapq.heappop(heap)
+        slot['start'] = free
+        slot['end'] = free + timedelta(seconds=slot['duration'])
+        lanes[mat].append(slot)
+        heapq.heappush(heap, (slot['end'], mat))
+
+    for lane in lanes.values():
+        for position, slot in enumerate(lane):
+            slot['position'] = position
+    return lanes
+
+
+def lane_end(lane, now):
+    return max([now] + [slot['end'] for slot in lane if 'end' in slot])
+
+
+def load_slots(competition_id):
+    """Сохраненный план: {category_id: (ковер, позиция)}"""
+    table = MatSlot.__table__
+    return {category_id: (mat, position) for category_id, mat, position in db.session.execute(
+        select(table.c.category_id, table.c.mat, table.c.position)
+        .where(table.c.competition_id == competition_id))}
+
+
+def save_slots(competition_id, lanes):
+    """Замена сохраненного плана соревнования; commit за вызывающим кодом"""
+    table = MatSlot.__table__
+    db.session.execute(delete(table).where(table.c.competition_id == competition_id))
+    rows = [{'competition_id': competition_id, 'category_id': slot['category_id'],
+             'mat': mat, 'position': slot['position']}
+            for mat, lane in lanes.items() for slot in lane]
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def plan_competition(competition_id, config, mats=None, reassign=False, now=None):
+    """План ковров с текущим прогнозом времени.
+
+    Без reassign сохраненный план только пересчитывается по фактическому темпу;
+    с reassign не начатые категории раскладываются заново (план нужно сохранить save_slots).
+    """
+    now = now or datetime.utcnow()
+    workload = category_workload(competition_id)
+    slots = load_slots(competition_id)
+    pace = observed_pace(workload, config['MAT_SECONDS_PER_PERFORMANCE'], config['MAT_PACE_MIN_SAMPLES'])
+    mats = mats or (max(mat for mat, _ in slots.values()) + 1 if slots else config['MAT_COUNT'])
+    lanes = build_plan(workload, slots, mats, now, pace, config['MAT_CHANGEOVER_SECONDS'],
+                       config['MAT_PACE_MIN_SAMPLES'], reassign=reassign or not slots,
+                       age_order=config['MAT_AGE_ORDER'])
+
+    finish = max([now] + [slot['end'] for lane in lanes.values() for slot in lane])
+    return {
+        'generated_at': now,
+        'saved': bool(slots) and not reassign,
+        'pace_seconds': round(pace, 1),
+        'finish': finish,
+        'mats': [{
+            'mat': mat + 1,
+            'end': lane_end(lane, now),
+            'slots': [dict(slot, mat=mat + 1, name=workload[slot['category_id']]['name'],
+                           athletes=workload[slot['category_id']]['athletes'],
+                           performed=workload[slot['category_id']]['performed'],
+                           performances=workload[slot['category_id']]['performances'])
+                      for slot in lane]
+        } for mat, lane in lanes.items()]
+    }, lanes
@@ -0,0 +1,198 @@
+import functools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+# Верхние границы корзин гистограмм, мс
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+# Общее состояние в таблице settings: сбор включен (0/1) и номер последнего сброса
+ENABLED_KEY = 'metrics_enabled'
+RESET_KEY = 'metrics_reset'
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for position, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[position] += 1
+                break
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'avg_ms': self.total / self.count if self.count else 0,
+            'max_ms': self.max,
+            # Пары (верхняя граница, число запросов) по возрастанию границы
+            'buckets': [['inf' if bound == float('inf') else bound, n] for bound, n in zip(BUCKETS, self.buckets)]
+        }
+
+
+class Metrics:
+    """Встроенные замеры: время маршрутов, SQL на запрос, подозрения на N+1, спаны горячих функций.
+
+    Включается параметром METRICS_ENABLED или на лету через POST /metrics, без перезапуска.
+    Выключенные замеры сводятся к одной проверке флага в обработчиках.
+    Переключатель и сброс хранятся в таблице settings и раз в METRICS_SYNC_SECONDS
+    перечитываются каждым процессом сервера; сами замеры у каждого процесса свои.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.n_plus_one_threshold = 10
+        self.slow_request_ms = 1000
+        self.sync_seconds = 2
+        self._synced_at = None
+        self._reset_generation = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def init_app(self, app):
+        self.enabled = app.config['METRICS_ENABLED']
+        self.n_plus_one_threshold = app.config['METRICS_N_PLUS_ONE_THRESHOLD']
+        self.slow_request_ms = app.config['METRICS_SLOW_REQUEST_MS']
+        self.sync_seconds = app.config['METRICS_SYNC_SECONDS']
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+            self.spans = {}
+            self.sql = {}
+            self.n_plus_one = Counter()
+
+    def share(self, enabled=None, reset=False):
+        """Переключение и сброс для всех процессов: запись в settings, commit за вызывающим кодом"""
+        from database import db
+        from models import Setting
+
+        table = Setting.__table__
+        if enabled is not None:
+            db.session.execute(sqlite_insert(table).values(key=ENABLED_KEY, value=int(enabled))
+                               .on_conflict_do_update(index_elements=[table.c.key], set_={'value': int(enabled)}))
+        if reset:
+            db.session.execute(sqlite_insert(table).values(key=RESET_KEY, value=1)
+                               .on_conflict_do_update(index_elements=[table.c.key],
+                                                      set_={'value': table.c.value + 1}))
+
+    def sync(self, force=False):
+        """Применение общего состояния из settings (не чаще раза в sync_seconds без force)"""
+        from database import db
+        from models import Setting
+
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_seconds:
+            return
+        self._synced_at = now
+        try:
+            values = dict(db.session.query(Setting.key, Setting.value)
+                          .filter(Setting.key.in_([ENABLED_KEY, RESET_KEY])).all())
+        except SQLAlchemyError:
+            # Таблицы еще нет (БД не инициализирована) - остается локальное состояние
+            db.session.rollback()
+            return
+
+        if ENABLED_KEY in values and bool(values[ENABLED_KEY]) != self.enabled:
+            self.enabled = bool(values[ENABLED_KEY])
+            logger.info(f"Сбор метрик {'включен' if self.enabled else 'выключен'}")
+        generation = values.get(RESET_KEY, 0)
+        if self._reset_generation is not None and generation != self._reset_generation:
+            self.reset()
+        self._reset_generation = generation
+
+    @contextmanager
+    def span(self, name):
+        """Замер участка кода: with metrics.span('pdf'): ..."""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.spans.setdefault(name, Histogram()).observe(elapsed)
+
+    def timed(self, name):
+        """Декоратор: каждый вызов функции - спан name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'routes': {name: histogram.snapshot() for name, histogram in self.routes.items()},
+                'sql': {name: dict(stats, avg_statements=stats['statements'] / stats['requests'])
+                        for name, stats in self.sql.items()},
+                'n_plus_one': dict(self.n_plus_one),
+                'spans': {name: histogram.snapshot() for name, histogram in self.spans.items()}
+            }
+
+    def _before_request(self):
+        self.sync()
+        if self.enabled:
+            g.metrics = {'started': time.perf_counter(), 'statements': Counter(), 'sql_ms': 0.0}
+
+    def _teardown_request(self, exc):
+        state = g.pop('metrics', None)
+        if state is None:
+            return
+        elapsed = (time.perf_counter() - state['started']) * 1000
+        route = request.url_rule.rule if request.url_rule else '<404>'
+        name = f'{request.method} {route}'
+        statements = sum(state['statements'].values())
+
+        with self._lock:
+            self.routes.setdefault(name, Histogram()).observe(elapsed)
+            sql = self.sql.setdefault(name, {'requests': 0, 'statements': 0, 'time_ms': 0.0})
+            sql['requests'] += 1
+            sql['statements'] += statements
+            sql['time_ms'] += state['sql_ms']
+
+        # Один и тот же запрос много раз за обработку - обычно ленивая загрузка в цикле
+        for statement, count in state['statements'].items():
+            if count >= self.n_plus_one_threshold and statement.lstrip().upper().startswith('SELECT'):
+                with self._lock:
+                    self.n_plus_one[name] += 1
+                logger.warning(f'Возможный N+1 в {name}: {count} одинаковых запросов: {" ".join(statement.split())[:200]}')
+        if elapsed >= self.slow_request_ms:
+            logger.warning(f'Медленный запрос {name}: {elapsed:.0f} мс, SQL: {statements} ({state["sql_ms"]:.0f} мс)')
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled and has_request_context() and 'metrics' in g:
+            context._metrics_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_metrics_started', None)
+        if started is None or not has_request_context() or 'metrics' not in g:
+            return
+        g.metrics['statements'][statement] += 1
+        g.metrics['sql_ms'] += (time.perf_counter() - started) * 1000
+
+
+metrics = Metrics()
@@ -0,0 +1,87 @@
+import os
+from contextlib import contextmanager
+from sqlalchemy import text
+from loguru import logger
+from database import db
+
+SCORES_UNIQUE_INDEX = 'uq_scores_participant_round'
+
+
+@contextmanager
+def exclusive_lock(path):
+    """Межпроцессная блокировка на файле path: схему БД обновляет один процесс, остальные ждут"""
+    with open(path, 'a+b') as lock_file:
+        if os.name == 'nt':
+            import msvcrt
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK ждет около 10 секунд и сдается - ждем дальше
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def upgrade_schema():
+    """Доводка существующей БД до текущих моделей.
+
+    db.create_all создает только недостающие таблицы, поэтому столбцы и индексы,
+    добавленные в модели позже, создаются здесь. Перед созданием уникального индекса по
+    (participant_id, round_number) удаляются дубли оценок, остается самая поздняя запись;
+    когда индекс уже есть, дублей быть не может и таблица оценок не читается.
+    """
+    with db.engine.begin() as connection:
+        added = add_missing_columns(connection)
+        if added:
+            logger.info(f"Добавлены столбцы: {', '.join(added)}")
+
+        existing = {name for name, in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        if SCORES_UNIQUE_INDEX not in existing:
+            removed = connection.execute(text(
+                "DELETE FROM scores WHERE id NOT IN ("
+                " SELECT MAX(id) FROM scores GROUP BY participant_id, round_number)"
+            )).rowcount
+            if removed:
+                logger.warning(f'Удалено дублей оценок: {removed}')
+
+        created = []
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(connection)
+                    created.append(index.name)
+        if created:
+            logger.info(f"Созданы индексы: {', '.join(created)}")
+            connection.execute(text('ANALYZE'))
+    return created
+
+
+def add_missing_columns(connection):
+    """ALTER TABLE ADD COLUMN для столбцов модели, которых нет в таблице"""
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = {row[1] for row in connection.execute(text(f'PRAGMA table_info({table.name})'))}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+            if default is not None:
+                ddl += f' DEFAULT {int(default) if isinstance(default, bool) else repr(default)}'
+            connection.execute(text(ddl))
+            added.append(f'{table.name}.{column.name}')
+    return added
@@ -0,0 +1,94 @@
+from sqlalchemy import and_, func, or_
+from database import db
+from models import Participant, Standing
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def category_filter(column, category_id):
+    """category_id=None - участники без категории"""
+    return column.is_(None) if category_id is None else column == category_id
+
+
+def category_counts(competition_id):
+    """Число участников по категориям одним GROUP BY: {category_id: n}"""
+    return dict(db.session.query(Participant.category_id, func.count(Participant.id))
+                .filter(Participant.competition_id == competition_id)
+                .group_by(Participant.category_id).all())
+
+
+def category_scores(competition_id):
+    """Число оцененных, средний, лучший и худший балл по категориям из турнирной таблицы"""
+    rows = db.session.query(Standing.category_id, func.count(Standing.id), func.avg(Standing.average),
+                            func.max(Standing.average), func.min(Standing.average)) \
+        .filter(Standing.competition_id == competition_id) \
+        .group_by(Standing.category_id).all()
+    return {category_id: {'count': count, 'average': average or 0, 'max': best or 0, 'min': worst or 0}
+            for category_id, count, average, best, worst in rows}
+
+
+def participants_page(competition_id, category_id, after=0, limit=PAGE_SIZE):
+    """Страница участников категории по id (keyset): (строки, курсор следующей страницы).
+
+    Запрос идет по индексу (competition_id, category_id) с диапазоном по id, поэтому
+    стоимость страницы не зависит от ее номера. Оценки берутся из турнирной таблицы.
+    """
+    rows = db.session.query(Participant, Standing).outerjoin(
+        Standing, Standing.participant_id == Participant.id
+    ).filter(
+        Participant.competition_id == competition_id,
+        category_filter(Participant.category_id, category_id),
+        Participant.id > after
+    ).order_by(Participant.id).limit(limit + 1).all()
+
+    page = []
+    for participant, standing in rows[:limit]:
+        row = participant_row(participant, standing)
+        row['age'] = participant.age
+        page.append(row)
+    next_cursor = page[-1]['athlete_id'] if len(rows) > limit else None
+    return page, next_cursor
+
+
+def results_page(competition_id, category_id, after=None, limit=PAGE_SIZE):
+    """Страница результатов категории в порядке мест: keyset по (средний балл, id)
+    вдоль индекса ix_standings_group.
+
+    after - курсор 'балл:id' последней строки предыдущей страницы. Как и в
+    calculate_final_results, в результатах только спортсмены с оценками.
+    """
+    query = db.session.query(Participant, Standing).join(
+        Standing, Standing.participant_id == Participant.id
+    ).filter(
+        Standing.competition_id == competition_id,
+        category_filter(Standing.category_id, category_id)
+    )
+    if after:
+        after_average, after_id = after.split(':')
+        after_average, after_id = float(after_average), int(after_id)
+        query = query.filter(or_(Standing.average < after_average,
+                                 and_(Standing.average == after_average, Standing.participant_id > after_id)))
+    rows = query.order_by(Standing.average.desc(), Standing.participant_id).limit(limit + 1).all()
+
+    page = [participant_row(participant, standing) for participant, standing in rows[:limit]]
+    next_cursor = f"{page[-1]['average']!r}:{page[-1]['athlete_id']}" if len(rows) > limit else None
+    return page, next_cursor
+
+
+def participant_row(participant, standing):
+    """Строка списка: данные спортсмена и его результат (если есть оценки)"""
+    return {
+        'athlete_id': participant.id,
+        'first_name': participant.first_name,
+        'last_name': participant.last_name,
+        'club': participant.club,
+        'gender': participant.gender,
+        'birth_date': participant.birth_date.isoformat() if participant.birth_date else None,
+        'round1': standing.round1 if standing else None,
+        'round2': standing.round2 if standing else None,
+        'round3': standing.round3 if standing else None,
+        'total': standing.total or 0 if standing else 0,
+        'average': standing.average or 0 if standing else 0,
+        'place': standing.place if standing else None
+    }
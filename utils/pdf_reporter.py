@@ -1,3 +1,9 @@
+import functools
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
@@ -5,88 +11,237 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch, cm
 from reportlab.pdfgen import canvas
 from reportlab.lib.enums import TA_CENTER
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from utils.metrics import metrics
 
-def generate_results_pdf(results, competition_info, output_path):
-    """Генерация PDF отчета с результатами"""
-    doc = SimpleDocTemplate(
-        output_path,
-        pagesize=A4,
-        rightMargin=72,
-        leftMargin=72,
-        topMargin=72,
-        bottomMargin=18
-    )
-    
-    story = []
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+# Шрифты с кириллицей: путь из окружения или распространенные системные (обычный, жирный)
+FONT_PATHS = [
+    (os.environ.get('PDF_FONT_PATH'), os.environ.get('PDF_FONT_BOLD_PATH')),
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/TTF/DejaVuSans.ttf', '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf',
+     '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf'),
+    ('C:\\Windows\\Fonts\\arial.ttf', 'C:\\Windows\\Fonts\\arialbd.ttf'),
+]
+
+
+@metrics.timed('generate_results_pdf')
+def generate_results_pdf(results, competition_info, output, workers=1, min_parallel_categories=8):
+    """Генерация PDF отчета с результатами в output (путь или файловый объект).
+
+    При workers > 1 и достаточном числе категорий каждая категория верстается
+    отдельным сегментом в пуле процессов, сегменты склеиваются по порядку.
+    """
+    categories = group_by_category(results)
+    if workers > 1 and len(categories) >= min_parallel_categories:
+        return generate_results_pdf_parallel(categories, competition_info, output, workers)
+
+    doc = create_document(output)
+    styles = get_styles()
+
+    story = build_header(competition_info, styles)
+    for category, cat_results in categories.items():
+        story.extend(build_category_story(category, cat_results, styles))
+    story.extend(build_signatures(styles))
+
+    doc.build(story)
+    return output
+
+
+@metrics.timed('generate_category_pdf')
+def generate_category_pdf(category, cat_results, competition_info, output):
+    """Протокол одной категории"""
+    doc = create_document(output)
+    styles = get_styles()
+
+    story = build_header(competition_info, styles)
+    story.extend(build_category_story(category, cat_results, styles))
+    story.extend(build_signatures(styles))
+
+    doc.build(story)
+    return output
+
+
+def generate_results_pdf_parallel(categories, competition_info, output, workers):
+    """Параллельная верстка категорий и склейка сегментов"""
+    from pypdf import PdfWriter
+
+    items = list(categories.items())
+    tasks = [(category, cat_results,
+              competition_info if position == 0 else None,
+              position == len(items) - 1)
+             for position, (category, cat_results) in enumerate(items)]
+
+    writer = PdfWriter()
+    for segment in get_pool(workers).map(render_segment, tasks):
+        writer.append(io.BytesIO(segment))
+    writer.write(output)
+    return output
+
+
+def render_segment(task):
+    """Сегмент PDF для одной категории (выполняется в дочернем процессе)"""
+    category, cat_results, competition_info, with_signatures = task
+    buffer = io.BytesIO()
+    doc = create_document(buffer)
+    styles = get_styles()
+
+    story = build_header(competition_info, styles) if competition_info else []
+    story.extend(build_category_story(category, cat_results, styles))
+    if with_signatures:
+        story.extend(build_signatures(styles))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def get_pool(workers):
+    """Пул процессов переиспользуется между вызовами, чтобы не платить за запуск каждый раз.
+
+    Создается под блокировкой: одновременные задачи экспорта получают один пул.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def find_fonts():
+    """Первая пара существующих файлов шрифтов или None"""
+    for regular, bold in FONT_PATHS:
+        if regular and os.path.exists(regular):
+            return regular, bold if bold and os.path.exists(bold) else regular
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_fonts():
+    """Регистрация шрифтов один раз на процесс: (обычный, жирный).
+
+    Без TTF с кириллицей остаются встроенные Helvetica - русский текст в них не отображается.
+    """
+    paths = find_fonts()
+    if paths is None:
+        return 'Helvetica', 'Helvetica-Bold'
+    pdfmetrics.registerFont(TTFont('ProtocolSans', paths[0]))
+    pdfmetrics.registerFont(TTFont('ProtocolSans-Bold', paths[1]))
+    return 'ProtocolSans', 'ProtocolSans-Bold'
+
+
+@functools.lru_cache(maxsize=None)
+def get_styles():
+    """Стили протокола строятся один раз на процесс и только читаются при верстке"""
+    regular, bold = get_fonts()
     styles = getSampleStyleSheet()
-    
+    for style in styles.byName.values():
+        if isinstance(style, ParagraphStyle):
+            style.fontName = bold if style.fontName.endswith('Bold') else regular
     # Заголовок
-    title_style = ParagraphStyle(
+    styles.add(ParagraphStyle(
         'CustomTitle',
         parent=styles['Heading1'],
         fontSize=24,
         spaceAfter=30,
         alignment=TA_CENTER
+    ))
+    return styles
+
+
+@functools.lru_cache(maxsize=None)
+def get_table_style():
+    regular, bold = get_fonts()
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, -1), regular),
+        ('FONTNAME', (0, 0), (-1, 0), bold),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+    ])
+
+
+def create_document(output):
+    return SimpleDocTemplate(
+        output,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=18
     )
-    
-    story.append(Paragraph(f"Протокол соревнований: {competition_info['name']}", title_style))
-    story.append(Paragraph(f"Дата: {competition_info['date']}", styles['Normal']))
-    story.append(Paragraph(f"Место проведения: {competition_info['location']}", styles['Normal']))
-    story.append(Spacer(1, 20))
-    
-    # Группировка по категориям
+
+
+def group_by_category(results):
+    """Группировка по категориям с сохранением порядка появления"""
     categories = {}
     for result in results:
         category = result['category']
         if category not in categories:
             categories[category] = []
         categories[category].append(result)
-    
-    # Таблица для каждой категории
-    for category, cat_results in categories.items():
-        story.append(Paragraph(f"Категория: {category}", styles['Heading2']))
-        story.append(Spacer(1, 10))
-        
-        # Сортировка по месту
-        cat_results.sort(key=lambda x: x['place'])
-        
-        # Подготовка данных для таблицы
-        data = [['Место', 'Спортсмен', 'Клуб', 'Раунд 1', 'Раунд 2', 'Раунд 3', 'Общий', 'Средний']]
-        
-        for result in cat_results:
-            data.append([
-                str(result['place']),
-                f"{result['last_name']} {result['first_name']}",
-                result['club'],
-                f"{result['round1']:.2f}" if result['round1'] else '-',
-                f"{result['round2']:.2f}" if result['round2'] else '-',
-                f"{result['round3']:.2f}" if result['round3'] else '-',
-                f"{result['total']:.2f}" if result['total'] else '-',
-                f"{result['average']:.2f}" if result['average'] else '-'
-            ])
-        
-        # Создание таблицы
-        table = Table(data, colWidths=[1*cm, 4*cm, 3*cm, 2*cm, 2*cm, 2*cm, 2*cm, 2*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ALIGN', (1, 1), (1, -1), 'LEFT'),
-        ]))
-        
-        story.append(table)
-        story.append(Spacer(1, 30))
-    
+    return categories
+
+
+def build_header(competition_info, styles):
+    return [
+        Paragraph(f"Протокол соревнований: {competition_info['name']}", styles['CustomTitle']),
+        Paragraph(f"Дата: {competition_info['date']}", styles['Normal']),
+        Paragraph(f"Место проведения: {competition_info['location']}", styles['Normal']),
+        Spacer(1, 20),
+    ]
+
+
+def build_category_story(category, cat_results, styles):
+    """Таблица для одной категории"""
+    story = []
+    story.append(Paragraph(f"Категория: {category}", styles['Heading2']))
+    story.append(Spacer(1, 10))
+
+    # Сортировка по месту
+    cat_results = sorted(cat_results, key=lambda x: x['place'])
+
+    # Подготовка данных для таблицы
+    data = [['Место', 'Спортсмен', 'Клуб', 'Раунд 1', 'Раунд 2', 'Раунд 3', 'Общий', 'Средний']]
+
+    for result in cat_results:
+        data.append([
+            str(result['place']),
+            f"{result['last_name']} {result['first_name']}",
+            result['club'],
+            f"{result['round1']:.2f}" if result['round1'] else '-',
+            f"{result['round2']:.2f}" if result['round2'] else '-',
+            f"{result['round3']:.2f}" if result['round3'] else '-',
+            f"{result['total']:.2f}" if result['total'] else '-',
+            f"{result['average']:.2f}" if result['average'] else '-'
+        ])
+
+    # Создание таблицы
+    table = Table(data, colWidths=[1*cm, 4*cm, 3*cm, 2*cm, 2*cm, 2*cm, 2*cm, 2*cm])
+    table.setStyle(get_table_style())
+
+    story.append(table)
+    story.append(Spacer(1, 30))
+    return story
+
+
+def build_signatures(styles):
     # Подписи
-    story.append(Spacer(1, 50))
-    story.append(Paragraph("Главный судья: _________________________", styles['Normal']))
-    story.append(Spacer(1, 20))
-    story.append(Paragraph("Главный секретарь: _________________________", styles['Normal']))
-    
-    doc.build(story)
-    return output_path
\ No newline at end of file
+    return [
+        Spacer(1, 50),
+        Paragraph("Главный судья: _________________________", styles['Normal']),
+        Spacer(1, 20),
+        Paragraph("Главный секретарь: _________________________", styles['Normal']),
+    ]
@@ -0,0 +1,74 @@
+from sqlalchemy import event
+from database import db
+
+# Маршруты чтения, запросы которых проверяются (GET, данные не меняются)
+ROUTES = [
+    '/',
+    '/competition/{id}',
+    '/competition/{id}/categories/',
+    '/competition/{id}/categories_view/',
+    '/results/{id}',
+    '/standings/{id}',
+    '/competition/{id}/categories/0/participants',
+    '/results/{id}/category/0',
+]
+
+
+def capture_route_queries(app, competition_id):
+    """Запросы, выполненные каждым маршрутом: {маршрут: [(sql, параметры)]}"""
+    captured = {}
+    current = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith('SELECT'):
+            current.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    client = app.test_client()
+    logger_disabled, app.logger.disabled = app.logger.disabled, True
+    try:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        for route in ROUTES:
+            url = route.format(id=competition_id)
+            current.clear()
+            try:
+                client.get(url)
+            except Exception:
+                # Ошибка шаблона не мешает проверить уже выполненные запросы
+                pass
+            captured[url] = list(current)
+    finally:
+        if event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+        app.logger.disabled = logger_disabled
+    return captured
+
+
+def explain(statement, parameters):
+    """EXPLAIN QUERY PLAN для запроса; возвращает строки плана"""
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    return [row[-1] for row in rows]
+
+
+def is_full_scan(plan_line):
+    """SCAN без индекса - полный проход по таблице"""
+    return plan_line.startswith('SCAN') and 'INDEX' not in plan_line
+
+
+def audit_routes(app, competition_id):
+    """Планы запросов по маршрутам: {маршрут: [(sql, план, есть ли полный проход)]}"""
+    report = {}
+    for url, queries in capture_route_queries(app, competition_id).items():
+        with app.app_context():
+            plans = []
+            seen = set()
+            for statement, parameters in queries:
+                if statement in seen:
+                    continue
+                seen.add(statement)
+                plan = explain(statement, parameters)
+                plans.append((statement, plan, any(is_full_scan(line) for line in plan)))
+        report[url] = plans
+    return report
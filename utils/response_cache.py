@@ -0,0 +1,67 @@
+import threading
+from collections import Counter, OrderedDict
+from utils.data_versions import data_versions, ALL_COMPETITIONS
+
+
+class ResponseCache:
+    """LRU-кэш данных страниц чтения с версиями по соревнованиям.
+
+    Ключ записи - (страница, соревнование, версия соревнования). Запись данных
+    соревнования отмечается через invalidate, версия увеличивается в той же транзакции,
+    и следующие запросы строят данные заново; записи старых версий этого процесса
+    удаляются сразу после commit. Версии хранятся в БД (data_versions), поэтому
+    изменение в любом процессе сервера сбрасывает кэш во всех процессах.
+    Версия ALL_COMPETITIONS (главная страница) растет при любом изменении.
+    """
+
+    def __init__(self):
+        self.max_entries = 256
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_entries = app.config['RESPONSE_CACHE_SIZE']
+        data_versions.on_commit(self._after_commit)
+
+    def invalidate(self, competition_id=ALL_COMPETITIONS):
+        """Данные соревнования меняются в текущей транзакции"""
+        data_versions.bump(competition_id)
+
+    def get_or_set(self, name, competition_id, build):
+        """Данные страницы name из кэша; build() вызывается при промахе"""
+        # Версия читается до построения: данные, изменившиеся во время build, получат новую версию
+        key = (name, competition_id, data_versions.current(competition_id))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits[name] += 1
+                return self._entries[key]
+            self.misses[name] += 1
+
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            requests = sum(self.hits.values()) + sum(self.misses.values())
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+                'hit_ratio': sum(self.hits.values()) / requests if requests else 0
+            }
+
+    def _after_commit(self, versions):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] in versions and key[2] < versions[key[1]]]:
+                del self._entries[key]
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,86 @@
+import math
+import numpy as np
+from sqlalchemy import select
+from database import db
+from models import Participant, Category, Score
+from utils.scoring import best_rounds, rank, round_totals, scoring_rule
+
+NO_CATEGORY = 'Без категории'
+ROUNDS = (1, 2, 3)
+
+
+def is_valid_round(value):
+    """Номер раунда из запроса: целое число (не bool) из ROUNDS"""
+    return type(value) is int and value in ROUNDS
+
+
+def load_score_cube(competition_id, judge_fields=None):
+    """Оценки соревнования одним запросом в массив (спортсмены x раунды x судьи).
+
+    Возвращает (id спортсменов по возрастанию, массив); нет оценки - NaN.
+    Участники, отключенные при повторной загрузке состава, в результаты не входят.
+    """
+    judge_fields = judge_fields or scoring_rule.judge_fields
+    scores, participants = Score.__table__, Participant.__table__
+    rows = db.session.execute(
+        select(scores.c.participant_id, scores.c.round_number, *(scores.c[field] for field in judge_fields))
+        .join(participants, participants.c.id == scores.c.participant_id)
+        .where(participants.c.competition_id == competition_id, participants.c.is_active.isnot(False))).all()
+    if not rows:
+        return np.empty(0, dtype=int), np.empty((0, len(ROUNDS), len(judge_fields)))
+
+    # Row SQLAlchemy numpy разбирает медленно - сначала в кортежи
+    data = np.array([tuple(row) for row in rows], dtype=float)
+    participant_ids, athletes = np.unique(data[:, 0].astype(int), return_inverse=True)
+    rounds = data[:, 1].astype(int) - ROUNDS[0]
+    known = (rounds >= 0) & (rounds < len(ROUNDS))
+
+    cube = np.full((len(participant_ids), len(ROUNDS), len(judge_fields)), np.nan)
+    cube[athletes[known], rounds[known]] = data[known, 2:]
+    return participant_ids, cube
+
+
+def calculate_final_results(competition_id, trim=None, best=None, judge_fields=None):
+    """Расчет финальных результатов: оценки соревнования одним массивом, отсечение крайних
+    оценок, суммы раундов, лучшие раунды и места - векторно, без цикла по спортсменам.
+
+    Не заданные trim, best и judge_fields берутся из правила подсчета (scoring_rule).
+    """
+    trim = scoring_rule.trim if trim is None else trim
+    best = scoring_rule.best if best is None else best
+    participant_ids, cube = load_score_cube(competition_id, judge_fields)
+    if not len(participant_ids):
+        return []
+
+    participants, categories = Participant.__table__, Category.__table__
+    athletes = {row[0]: row for row in db.session.execute(
+        select(participants.c.id, participants.c.first_name, participants.c.last_name,
+               participants.c.club, participants.c.category_id, categories.c.name)
+        .outerjoin(categories, categories.c.id == participants.c.category_id)
+        .where(participants.c.competition_id == competition_id))}
+
+    rounds = round_totals(cube, trim)
+    totals, averages = best_rounds(rounds, best)
+    groups = np.array([athletes[pid][4] or 0 for pid in participant_ids.tolist()])
+    places = rank(averages, groups, participant_ids)
+
+    # Сортировка по среднему баллу, места считаются в пределах категории
+    results = []
+    for position in np.lexsort((participant_ids, -averages)).tolist():
+        athlete_id, first_name, last_name, club, category_id, category_name = athletes[int(participant_ids[position])]
+        round1, round2, round3 = (None if math.isnan(value) else value for value in rounds[position].tolist())
+        results.append({
+            'athlete_id': athlete_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'club': club,
+            'category': category_name or NO_CATEGORY,
+            'category_id': category_id,
+            'round1': round1,
+            'round2': round2,
+            'round3': round3,
+            'total': float(totals[position]),
+            'average': float(averages[position]),
+            'place': int(places[position])
+        })
+    return results
@@ -0,0 +1,120 @@
+import numpy as np
+
+JUDGE_FIELDS = ['judge1', 'judge2', 'judge3', 'judge4', 'referee']  # все поля оценок в Score
+TRIM = 1  # сколько крайних оценок отбрасывается с каждой стороны
+BEST_ROUNDS = 2  # в зачет идут лучшие раунды
+
+
+class ScoringRule:
+    """Правило подсчета из настроек SCORING_*: чьи оценки учитываются, сколько крайних
+    отбрасывается и сколько лучших раундов идет в зачет.
+
+    Одно правило для ввода оценок, турнирной таблицы и протоколов, поэтому они
+    не расходятся при изменении настроек.
+    """
+
+    def __init__(self):
+        self.judge_fields = list(JUDGE_FIELDS)
+        self.trim = TRIM
+        self.best = BEST_ROUNDS
+
+    def init_app(self, app):
+        judge_fields = list(app.config['SCORING_JUDGE_FIELDS'])
+        trim, best = app.config['SCORING_TRIM'], app.config['SCORING_BEST_ROUNDS']
+        unknown = [field for field in judge_fields if field not in JUDGE_FIELDS]
+        if not judge_fields or unknown:
+            raise ValueError(f"SCORING_JUDGE_FIELDS: допустимы поля {', '.join(JUDGE_FIELDS)}")
+        if trim < 0 or 2 * trim >= len(judge_fields):
+            raise ValueError('SCORING_TRIM: после отсечения должна остаться хотя бы одна оценка')
+        if best < 1:
+            raise ValueError('SCORING_BEST_ROUNDS должно быть не меньше 1')
+        self.judge_fields, self.trim, self.best = judge_fields, trim, best
+
+    def totals(self, judge_scores):
+        """Суммы раундов для матрицы (строки x judge_fields)"""
+        return calculate_totals(judge_scores, self.trim)
+
+    def round_total(self, scores):
+        """Сумма одного раунда по оценкам в порядке judge_fields; None - оценок нет"""
+        total = self.totals([scores])[0]
+        return None if np.isnan(total) else float(total)
+
+    def final(self, round_scores):
+        """Сумма и среднее лучших раундов одного спортсмена (None - раунда нет)"""
+        total, average = best_rounds(np.array([round_scores], dtype=float), self.best)
+        return float(total[0]), float(average[0])
+
+
+def is_valid_score(value):
+    """Оценка судьи из запроса: конечное число (не bool) или None - оценки нет"""
+    if value is None:
+        return True
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and bool(np.isfinite(value))
+
+
+def calculate_totals(judge_scores, trim=TRIM):
+    """Score.calculate_scores для многих строк сразу.
+
+    judge_scores - матрица (строки x судьи), None/NaN - нет оценки.
+    Для каждой строки отбрасываются trim минимальных и trim максимальных из
+    выставленных оценок, остальные суммируются. Строка без оценок дает NaN.
+    """
+    matrix = np.asarray(judge_scores, dtype=float)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+
+    # NaN сортируются в конец строки, выставленные оценки - по возрастанию
+    ordered = np.sort(matrix, axis=1)
+    counts = (~np.isnan(matrix)).sum(axis=1)
+    positions = np.arange(matrix.shape[1])
+    middle = (positions >= trim) & (positions < (counts - trim)[:, None])
+
+    totals = np.where(middle, ordered, 0.0).sum(axis=1)
+    totals[counts == 0] = np.nan
+    return totals
+
+
+def round_totals(cube, trim=TRIM):
+    """Суммы раундов для массива (спортсмены x раунды x судьи) -> (спортсмены x раунды)"""
+    athletes, rounds, judges = cube.shape
+    return calculate_totals(cube.reshape(-1, judges), trim).reshape(athletes, rounds)
+
+
+def best_rounds(totals, best=BEST_ROUNDS):
+    """Сумма и среднее best лучших раундов каждого спортсмена (best_two_of_three для массива).
+
+    Если раундов с оценкой меньше best, берутся все имеющиеся; без оценок - 0 и 0.
+    """
+    # По убыванию, раунды без оценки (NaN) - в конце строки
+    ordered = -np.sort(-totals, axis=1)
+    counted = np.minimum((~np.isnan(totals)).sum(axis=1), best)
+    taken = np.arange(totals.shape[1]) < counted[:, None]
+    total = np.where(taken, ordered, 0.0).sum(axis=1)
+    average = np.divide(total, counted, out=np.zeros_like(total), where=counted > 0)
+    return total, average
+
+
+def rank(averages, groups, ids):
+    """Места внутри групп: по убыванию среднего, равный балл - общее место (1, 1, 3).
+
+    groups - номер группы (категории) каждого спортсмена, ids - порядок при равенстве.
+    Возвращает места в исходном порядке спортсменов.
+    """
+    order = np.lexsort((ids, -averages, groups))
+    sorted_groups = groups[order]
+    sorted_averages = averages[order]
+    positions = np.arange(len(order))
+
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    run_start = group_start.copy()
+    run_start[1:] |= sorted_averages[1:] != sorted_averages[:-1]
+
+    first_in_group = np.maximum.accumulate(np.where(group_start, positions, 0))
+    first_in_run = np.maximum.accumulate(np.where(run_start, positions, 0))
+    places = np.empty(len(order), dtype=int)
+    places[order] = first_in_run - first_in_group + 1
+    return places
+
+
+scoring_rule = ScoringRule()
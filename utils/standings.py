@@ -0,0 +1,230 @@
+import threading
+import math
+from bisect import bisect_left, bisect_right, insort
+from database import db
+from models import Participant, Score, Standing
+from utils.results import calculate_final_results, ROUNDS
+from utils.scoring import scoring_rule
+from utils.data_versions import data_versions
+from utils.live import live_results
+from utils.response_cache import response_cache
+
+
+class StandingsIndex:
+    """Упорядоченный индекс турнирной таблицы в памяти процесса.
+
+    Для каждой группы (соревнование, категория) хранится отсортированный список
+    ключей (-средний балл, participant_id), поэтому страница таблицы и место
+    спортсмена находятся бинарным поиском. Индекс помнит версию данных каждого
+    соревнования (data_versions) и перечитывается, если оценки записал другой процесс.
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._averages = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self, group):
+        if group in self._keys:
+            return
+        competition_id, category_id = group
+        rows = db.session.query(Standing.participant_id, Standing.average).filter(
+            Standing.competition_id == competition_id,
+            Standing.category_id == category_id).all()
+        averages = {participant_id: average or 0 for participant_id, average in rows}
+        self._averages[group] = averages
+        self._keys[group] = sorted((-average, participant_id) for participant_id, average in averages.items())
+
+    def load(self, group):
+        """Загрузка группы из таблицы, если ее еще нет в памяти"""
+        with self._lock:
+            self._ensure_loaded(group)
+
+    def invalidate(self, group=None):
+        """Сброс группы (или всего индекса) после отката транзакции или перестроения"""
+        with self._lock:
+            if group is None:
+                self._keys.clear()
+                self._averages.clear()
+                self._versions.clear()
+            else:
+                self._keys.pop(group, None)
+                self._averages.pop(group, None)
+                # Версия отката могла достаться другому процессу - соревнование сверяется заново
+                self._versions.pop(group[0], None)
+
+    def sync(self, competition_id, version, written=False):
+        """Сверка с версией данных соревнования; группы, измененные другим процессом, сбрасываются.
+
+        written=True - version только что получена data_versions.bump в текущей транзакции:
+        индекс актуален, если знал предыдущую версию.
+        """
+        with self._lock:
+            known = self._versions.get(competition_id)
+            if known != version and not (written and known == version - 1):
+                for group in [group for group in self._keys if group[0] == competition_id]:
+                    del self._keys[group]
+                    del self._averages[group]
+            self._versions[competition_id] = version
+
+    def place_of(self, group, average):
+        """Место с учетом дележа: 1 + число спортсменов со строго большим баллом"""
+        return bisect_left(self._keys[group], (-average,)) + 1
+
+    def update(self, group, participant_id, average):
+        """Перемещение спортсмена в индексе; возвращает спортсменов, чьи места могли сдвинуться"""
+        with self._lock:
+            self._ensure_loaded(group)
+            keys = self._keys[group]
+            averages = self._averages[group]
+
+            old_average = averages.get(participant_id)
+            if old_average is not None:
+                del keys[bisect_left(keys, (-old_average, participant_id))]
+            insort(keys, (-average, participant_id))
+            averages[participant_id] = average
+
+            # Место меняется только у тех, чей балл лежит между старым и новым
+            if old_average is None:
+                lo, hi = bisect_left(keys, (-average,)), len(keys)
+            else:
+                high, low = max(old_average, average), min(old_average, average)
+                lo, hi = bisect_left(keys, (-high,)), bisect_right(keys, (-low, float('inf')))
+
+            return {pid: self.place_of(group, -neg_average) for neg_average, pid in keys[lo:hi]}
+
+    def page(self, group, offset=0, limit=50):
+        """Участники страницы таблицы в порядке мест"""
+        with self._lock:
+            self._ensure_loaded(group)
+            return [participant_id for _, participant_id in self._keys[group][offset:offset + limit]]
+
+    def size(self, group):
+        with self._lock:
+            self._ensure_loaded(group)
+            return len(self._keys[group])
+
+
+standings_index = StandingsIndex()
+
+
+def record_score(participant):
+    """Обновление таблицы после записи оценки (вызывается до commit)"""
+    # Рост версии сбрасывает кэш страниц и упорядочивает запись оценок между процессами
+    version = data_versions.bump(participant.competition_id)
+    standings_index.sync(participant.competition_id, version, written=True)
+    db.session.flush()
+    # Суммы раундов из оценок судей по тому же правилу, что и в calculate_final_results
+    rows = db.session.query(Score.round_number, *(getattr(Score, field) for field in scoring_rule.judge_fields)
+                            ).filter(Score.participant_id == participant.id).all()
+    rounds = {}
+    if rows:
+        totals = scoring_rule.totals([tuple(row[1:]) for row in rows])
+        rounds = {row[0]: None if math.isnan(value) else value for row, value in zip(rows, totals.tolist())}
+    round1, round2, round3 = (rounds.get(n) for n in ROUNDS)
+    total, average = scoring_rule.final([round1, round2, round3])
+
+    # Группа читается из таблицы до изменения строки: иначе autoflush
+    # запишет новый балл раньше, и индекс получит его как старый
+    group = (participant.competition_id, participant.category_id)
+    standings_index.load(group)
+
+    standing = Standing.query.filter_by(participant_id=participant.id).first()
+    if standing is None:
+        standing = Standing(participant_id=participant.id)
+        db.session.add(standing)
+    elif (standing.competition_id, standing.category_id) != (participant.competition_id, participant.category_id):
+        # Спортсмен сменил категорию: старую группу проще перечитать из таблицы
+        standings_index.invalidate((standing.competition_id, standing.category_id))
+
+    standing.competition_id = participant.competition_id
+    standing.category_id = participant.category_id
+    standing.round1, standing.round2, standing.round3 = round1, round2, round3
+    standing.total = total
+    standing.average = average
+    standing.version = version
+
+    places = standings_index.update(group, participant.id, average)
+    standing.place = places.get(participant.id, standing.place)
+
+    # Сдвиг мест у соседей одним запросом
+    shifted = {pid: place for pid, place in places.items() if pid != participant.id}
+    if shifted:
+        for row in Standing.query.filter(Standing.participant_id.in_(shifted)).all():
+            row.place = shifted[row.participant_id]
+            row.version = version
+    live_results.mark_changed(participant.competition_id, [participant.id, *shifted])
+    return standing
+
+
+def get_standings_page(competition_id, category_id, offset=0, limit=50):
+    """Страница турнирной таблицы категории без пересчета результатов"""
+    group = (competition_id, category_id)
+    standings_index.sync(competition_id, data_versions.current(competition_id))
+    participant_ids = standings_index.page(group, offset, limit)
+    if not participant_ids:
+        return []
+
+    rows = db.session.query(Standing, Participant).join(
+        Participant, Participant.id == Standing.participant_id).filter(
+        Standing.participant_id.in_(participant_ids)).all()
+    by_id = {standing.participant_id: (standing, participant) for standing, participant in rows}
+
+    page = []
+    for participant_id in participant_ids:
+        if participant_id not in by_id:
+            continue
+        standing, participant = by_id[participant_id]
+        page.append({
+            'athlete_id': participant_id,
+            'first_name': participant.first_name,
+            'last_name': participant.last_name,
+            'club': participant.club,
+            'round1': standing.round1,
+            'round2': standing.round2,
+            'round3': standing.round3,
+            'total': standing.total,
+            'average': standing.average,
+            'place': standing.place
+        })
+    return page
+
+
+def rebuild_standings(competition_id, commit=True):
+    """Полное перестроение таблицы соревнования из таблицы scores"""
+    results = calculate_final_results(competition_id)
+    # Клиентам таблицы проще перечитать ее целиком
+    version = live_results.mark_reset(competition_id)
+
+    Standing.query.filter_by(competition_id=competition_id).delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(Standing, [{
+        'competition_id': competition_id,
+        'category_id': result['category_id'],
+        'participant_id': result['athlete_id'],
+        'round1': result['round1'],
+        'round2': result['round2'],
+        'round3': result['round3'],
+        'total': result['total'],
+        'average': result['average'],
+        'place': result['place'],
+        'version': version
+    } for result in results])
+    response_cache.invalidate(competition_id)
+    if commit:
+        db.session.commit()
+    standings_index.invalidate()
+    return results
+
+
+def check_standings(competition_id):
+    """Сверка сохраненной таблицы с calculate_final_results; возвращает расхождения
+    {участник: ((категория, место, средний) ожидаемые, в таблице)}"""
+    expected = {r['athlete_id']: (r['category_id'], r['place'], round(r['average'], 6))
+                for r in calculate_final_results(competition_id)}
+    actual = {s.participant_id: (s.category_id, s.place, round(s.average or 0, 6))
+              for s in Standing.query.filter_by(competition_id=competition_id).all()}
+    return {pid: (expected.get(pid), actual.get(pid))
+            for pid in expected.keys() | actual.keys()
+            if expected.get(pid) != actual.get(pid)}
+
@@ -0,0 +1,40 @@
+"""Точка входа рабочего сервера: несколько процессов и потоков вместо отладочного app.run.
+
+Linux - процесс на ядро, потоки внутри процесса (настройки в gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Windows - один процесс с пулом потоков (LIVE_MAX_STREAMS=8 в окружении - половина потоков):
+
+    waitress-serve --listen=0.0.0.0:8000 --threads=16 wsgi:app
+
+Процессы работают с одной БД и папкой загрузок: кэши в памяти сверяются с версиями
+данных в БД, фоновые задачи забирает один процесс, лог пишет процесс-родитель.
+Каждый открытый поток результатов (табло) занимает поток сервера до закрытия страницы.
+Процесс держит не больше LIVE_MAX_STREAMS табло (сверх лимита - 503, страница
+переподключается через LIVE_RETRY_SECONDS), чтобы ввод оценок не остался без потоков.
+Для большого числа табло потоки результатов обслуживает отдельный экземпляр с большим
+числом потоков, а прокси направляет туда только /results/<id>/stream:
+
+    WEB_CONCURRENCY=1 WEB_THREADS=512 LIVE_MAX_STREAMS=500 BIND=127.0.0.1:8001 \\
+        gunicorn -c gunicorn.conf.py wsgi:app
+
+    # nginx
+    location ~ ^/results/[0-9]+/stream$ {
+        proxy_pass http://127.0.0.1:8001;
+        proxy_buffering off;
+        proxy_read_timeout 1h;
+    }
+    location / {
+        proxy_pass http://127.0.0.1:8000;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+    }
+
+Экземпляры работают с одной БД, изменения из других процессов табло получают через
+data_versions (LIVE_POLL_SECONDS). За прокси все запросы приходят с 127.0.0.1, поэтому
+/metrics открывается по METRICS_TOKEN (заголовок X-Metrics-Token); без токена запросы
+с X-Forwarded-For к нему не допускаются.
+"""
+from app import create_app
+
+app = create_app()